@@ -2,18 +2,43 @@
 #
 #
 
-from collections import defaultdict
-from requests import Session
+from codecs import getincrementaldecoder
+from collections import defaultdict, deque
+from argparse import ArgumentParser
+from asyncio import new_event_loop, run_coroutine_threadsafe
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, \
+    ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
+from gzip import open as gzip_open
+from hashlib import sha256
+from ipaddress import IPv4Address, IPv6Address
+from requests import Response, Session
+from requests.exceptions import ConnectionError, Timeout
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
 from logging import getLogger
+from multiprocessing import get_context
+from threading import Condition, Event, Lock, Thread, local
+from tempfile import gettempdir
+from time import monotonic, perf_counter, sleep, time
 from urllib.parse import urlparse
+from urllib3.util.request import ACCEPT_ENCODING
+import json
+import os
+import re
+import sqlite3
 
-from octodns.record import Record
+from octodns.record import Record, ValidationError
 from octodns.record.geo import GeoCodes
 from octodns.provider import ProviderException
 from octodns.provider.base import BaseProvider
+from octodns.zone import Zone
 
 __VERSION__ = '0.0.4'
 __API_VERSION__ = 'v2beta1'
+__SNAPSHOT_FORMAT__ = 'octodns-scaleway-snapshot'
+__SNAPSHOT_VERSION__ = 1
 
 
 class ScalewayClientException(ProviderException):
@@ -24,6 +49,39 @@ class ScalewayProviderException(ProviderException):
     pass
 
 
+class ScalewayProviderValidationError(ScalewayProviderException):
+    def __init__(self, reasons):
+        self.reasons = reasons
+        super(ScalewayProviderValidationError, self).__init__(
+            'Invalid changes:\n  - ' + '\n  - '.join(reasons))
+
+
+class ScalewayProviderDeadlineExceeded(ScalewayProviderException):
+    def __init__(self, zones):
+        self.zones = zones
+        super(ScalewayProviderDeadlineExceeded, self).__init__(
+            'Deadline exceeded, zones not done:\n  - ' +
+            '\n  - '.join(zones))
+
+
+class ScalewayProviderRejectedChanges(ScalewayProviderException):
+    def __init__(self, changes):
+        self.changes = changes
+        self.id_fields = []
+        for change in changes:
+            for params in change.values():
+                if 'idFields' in params:
+                    self.id_fields.append(params['idFields'])
+                else:
+                    self.id_fields.extend({
+                        'type': record['type'],
+                        'name': record['name']
+                    } for record in params['records'])
+        super(ScalewayProviderRejectedChanges, self).__init__(
+            'Rejected changes:\n  - ' +
+            '\n  - '.join(str(f) for f in self.id_fields))
+
+
 class ScalewayClientBadRequest(ScalewayClientException):
     def __init__(self):
         super(ScalewayClientBadRequest, self).__init__('Bad request')
@@ -50,18 +108,699 @@ class ScalewayClientUnknownDomainName(ScalewayClientException):
                                                               'found')
 
 
+class ScalewayClientCircuitOpen(ScalewayClientException):
+    def __init__(self, retry_in):
+        self.retry_in = retry_in
+        super(ScalewayClientCircuitOpen, self).__init__(
+            f'Circuit open, the API is failing, next probe in {retry_in:.0f}s')
+
+
+class ScalewayClientDeadlineExceeded(ScalewayClientException):
+    def __init__(self):
+        super(ScalewayClientDeadlineExceeded, self).__init__('Deadline '
+                                                             'exceeded')
+
+
+def _json_backend():
+    '''
+    Returns the (loads, dumps) pair of the fastest JSON library available,
+    dumps always returning compact bytes.
+    '''
+    try:
+        import orjson
+        return orjson.loads, orjson.dumps
+    except ImportError:
+        return json.loads, \
+            lambda data: json.dumps(data, separators=(',', ':')).encode()
+
+
+# the JSON backend shared by the client, the snapshots and the provider
+_loads, _dumps = _json_backend()
+
+
+def _request_kind(method, path, params):
+    '''
+    Returns what the latency of a request is compared with: its method, its
+    path with the zone name left out and its page size
+    '''
+    return (method, re.sub(r'^/dns-zones/[^/]+', '/dns-zones/{}', path),
+            params.get('page_size'))
+
+
+class _AimdLimiter(object):
+    '''
+    Adaptive limit of the requests in flight: raised by one after a limit's
+    worth of healthy requests, cut by backoff on throttling, server errors or
+    latency spikes, the latency of a request being compared with the one of
+    the requests of its kind.
+    '''
+    # samples of a kind needed before its latency spikes are detected
+    WARMUP = 5
+
+    def __init__(self, maximum, initial=4, minimum=1, backoff=0.5,
+                 spike=3.0):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = max(minimum, min(initial, maximum))
+        self.backoff = backoff
+        self.spike = spike
+
+        self._in_flight = 0
+        self._successes = 0
+        # kind -> smoothed latency of the healthy requests
+        self._latency = {}
+        self._samples = defaultdict(int)
+        # bumped by each decrease so that the requests which were in flight
+        # together only cut the limit once
+        self._generation = 0
+        self._cond = Condition()
+
+    def acquire(self, timeout=None):
+        '''
+        Waits for a slot, returning the current generation, None if timeout
+        passed first
+        '''
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._in_flight < self.limit,
+                                       timeout):
+                return None
+            self._in_flight += 1
+            return self._generation
+
+    def release(self, generation, latency, healthy, kind=None):
+        with self._cond:
+            self._in_flight -= 1
+            spike = healthy and self._samples[kind] >= self.WARMUP and \
+                latency > self.spike * self._latency[kind]
+            if not healthy or spike:
+                if generation == self._generation:
+                    self.limit = max(self.minimum,
+                                     int(self.limit * self.backoff))
+                    self._generation += 1
+                    self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self.limit = min(self.maximum, self.limit + 1)
+                    self._successes = 0
+            if healthy:
+                previous = self._latency.get(kind)
+                self._latency[kind] = latency if previous is None else \
+                    0.8 * previous + 0.2 * latency
+                self._samples[kind] += 1
+            self._cond.notify_all()
+
+
+class _CircuitBreaker(object):
+    '''
+    Fails the requests fast while the API is failing: opened when at least
+    threshold of the last window requests failed, half-opened after
+    reset_timeout to let a single probe through, closed again once it
+    succeeds.
+    '''
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, window=20, threshold=0.5, min_requests=10,
+                 reset_timeout=30):
+        self.threshold = threshold
+        self.min_requests = min_requests
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+
+        self._outcomes = deque(maxlen=window)
+        self._opened = None
+        self._lock = Lock()
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened = monotonic()
+        self._outcomes.clear()
+
+    def check(self):
+        '''
+        Raises ScalewayClientCircuitOpen unless a request can be sent
+        '''
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            retry_in = self._opened + self.reset_timeout - monotonic()
+            if self.state == self.OPEN and retry_in <= 0:
+                # this request is the probe
+                self.state = self.HALF_OPEN
+                return
+            raise ScalewayClientCircuitOpen(max(0, retry_in))
+
+    def record(self, success):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                if success:
+                    self.state = self.CLOSED
+                else:
+                    self._open()
+            elif self.state == self.CLOSED:
+                self._outcomes.append(success)
+                failures = self._outcomes.count(False)
+                if len(self._outcomes) >= self.min_requests and \
+                   failures >= self.threshold * len(self._outcomes):
+                    self._open()
+
+    def cancel(self):
+        '''
+        Forgets a request that tells nothing about the API, the next one
+        probing it if it was the probe
+        '''
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+
+def _close_response(future):
+    if future.exception() is None:
+        future.result().close()
+
+
+class _Hedger(object):
+    '''
+    Sends a duplicate of the requests which haven't answered within the
+    percentile of the recent latencies of the requests of their kind and
+    takes the first response. The duplicates are capped to budget of the
+    requests.
+    '''
+    WINDOW = 200
+    # latencies of a kind needed before hedging its requests
+    MIN_SAMPLES = 20
+
+    def __init__(self, percentile, budget, max_workers):
+        self.percentile = percentile
+        self.budget = budget
+
+        # kind -> the recent latencies
+        self._latencies = defaultdict(partial(deque, maxlen=self.WINDOW))
+        self._requests = 0
+        self._hedges = 0
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers,
+                                            thread_name_prefix='hedge')
+
+    def _threshold(self, kind):
+        with self._lock:
+            latencies = sorted(self._latencies[kind])
+        if len(latencies) < self.MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1,
+                             int(len(latencies) * self.percentile / 100))]
+
+    def _take_budget(self):
+        with self._lock:
+            if self._hedges + 1 > self.budget * self._requests:
+                return False
+            self._hedges += 1
+            return True
+
+    def send(self, send, kind=None):
+        '''
+        Calls send, a second time if the first call is slow for its kind,
+        returning the first response, the number of duplicates sent and
+        whether one of them won
+        '''
+        start = perf_counter()
+        threshold = self._threshold(kind)
+        with self._lock:
+            self._requests += 1
+
+        primary = self._executor.submit(send)
+        futures = [primary]
+        if threshold is not None and \
+           not wait(futures, timeout=threshold).done and self._take_budget():
+            futures.append(self._executor.submit(send))
+
+        # the first success, the last failure when all of them failed
+        pending = set(futures)
+        winner = None
+        while winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            succeeded = [f for f in done if f.exception() is None]
+            if succeeded:
+                winner = succeeded[0]
+            elif not pending:
+                winner = done.pop()
+        for future in futures:
+            if future is not winner:
+                future.add_done_callback(_close_response)
+
+        with self._lock:
+            self._latencies[kind].append(perf_counter() - start)
+        return winner.result(), len(futures) - 1, winner is not primary
+
+
+class _SharedTokenBucket(object):
+    '''
+    Token bucket kept in a SQLite file, shared by every client of the host
+    drawing from the same bucket. Tokens are reserved, the bucket going
+    negative, so that the callers get successive slots instead of all
+    retrying at once. Each thread keeps a connection of its own.
+    '''
+
+    def __init__(self, path, name, rate, burst):
+        self.path = path
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._local = local()
+        self._connection().execute('CREATE TABLE IF NOT EXISTS buckets (name '
+                                   'TEXT PRIMARY KEY, tokens REAL, updated '
+                                   'REAL)')
+
+    def _connection(self):
+        # a connection can't be shared with a forked process
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.conn = sqlite3.connect(self.path, timeout=30,
+                                               isolation_level=None)
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def reserve(self):
+        '''
+        Takes a token, returning the seconds to wait before using it
+        '''
+        conn = self._connection()
+        # the write lock serializes the processes
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time()
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE '
+                               'name = ?', (self.name,)).fetchone()
+            tokens = self.burst if row is None else \
+                min(self.burst, row[0] + (now - row[1]) * self.rate)
+            tokens -= 1
+            conn.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)',
+                         (self.name, tokens, now))
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return max(0, -tokens / self.rate)
+
+
+class _JsonStream(object):
+    '''
+    Incremental decoder of a JSON object read chunk after chunk, yielding the
+    items of one of its array members as soon as they are complete.
+    '''
+
+    _whitespace_re = re.compile(r'\s*')
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._text = getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self.bytes = 0
+        self.decode_seconds = 0
+        # the other members of the object, once items has been exhausted
+        self.members = {}
+
+    def _fill(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+            text = self._text.decode(b'', final=True)
+        else:
+            self.bytes += len(chunk)
+            text = self._text.decode(chunk)
+        # only keep what hasn't been consumed yet
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        return chunk is not None
+
+    def _peek(self):
+        while True:
+            self._pos = self._whitespace_re.match(self._buffer,
+                                                  self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, chars):
+        c = self._peek()
+        if not c or c not in chars:
+            raise ValueError(f'Expecting one of {chars!r}, got {c!r}')
+        self._pos += 1
+        return c
+
+    def _value(self):
+        self._peek()
+        while True:
+            start = perf_counter()
+            try:
+                value, end = self._decoder.raw_decode(self._buffer,
+                                                      self._pos)
+                # a value reaching the end of the buffer may be truncated,
+                # e.g. a number
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            finally:
+                self.decode_seconds += perf_counter() - start
+            self._fill()
+
+    def items(self, key):
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            name = self._value()
+            self._expect(':')
+            if name != key:
+                self.members[name] = self._value()
+            elif self._peek() == '[':
+                self._pos += 1
+                if self._peek() == ']':
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(',]') == ']':
+                            break
+            else:
+                raise ValueError(f'Expecting an array for {key!r}')
+            if self._expect(',}') == '}':
+                return
+
+
+def _requests_transport(headers):
+    '''
+    HTTP/1.1 transport, a requests Session and its pool of connections
+    '''
+    session = Session()
+    session.headers.update(headers)
+    # every encoding urllib3 is able to decode, br and zstd included when
+    # their libraries are installed
+    session.headers['accept-encoding'] = ACCEPT_ENCODING
+    return session
+
+
+class _Http2Raw(object):
+    '''
+    The body of an httpx response read as the raw stream of a requests
+    Response: decoded chunks, telling the bytes received
+    '''
+
+    def __init__(self, response, transport):
+        self._response = response
+        self._transport = transport
+        self._chunks = response.aiter_bytes()
+        self._buffer = b''
+
+    async def _next(self):
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def read(self, size):
+        try:
+            while len(self._buffer) < size:
+                chunk = self._transport.run(self._next())
+                if chunk is None:
+                    break
+                self._buffer += chunk
+        except self._transport.errors as e:
+            raise self._transport.error(e) from e
+        ret, self._buffer = self._buffer[:size], self._buffer[size:]
+        return ret
+
+    def tell(self):
+        return self._response.num_bytes_downloaded
+
+    def close(self):
+        self._transport.run(self._response.aclose())
+
+
+class _Http2Transport(object):
+    '''
+    HTTP/2 transport multiplexing the requests over a few connections with
+    httpx, its responses turned into requests ones. The async client runs on
+    an event loop of its own, the sync one opening the streams of concurrent
+    threads out of order
+    '''
+
+    def __init__(self, headers, **kwargs):
+        try:
+            import httpx
+            self._client = httpx.AsyncClient(http2=True, headers=headers,
+                                             **kwargs)
+        except ImportError:
+            raise ScalewayClientException('The http2 transport requires '
+                                          'httpx[http2]')
+        self._timeout_errors = httpx.TimeoutException
+        self.errors = httpx.TransportError
+        self._loop = new_event_loop()
+        self._thread = Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine):
+        # the result of the coroutine, run on the loop
+        return run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def error(self, e):
+        # the requests exception of an httpx one
+        if isinstance(e, self._timeout_errors):
+            return Timeout(str(e))
+        return ConnectionError(str(e))
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                stream=False, timeout=None):
+        request = self._client.build_request(method, url, params=params,
+                                             content=data, headers=headers,
+                                             timeout=timeout)
+        try:
+            response = self.run(self._client.send(request, stream=True))
+        except self.errors as e:
+            raise self.error(e) from e
+
+        r = Response()
+        r.status_code = response.status_code
+        r.headers = CaseInsensitiveDict(response.headers)
+        r.encoding = get_encoding_from_headers(r.headers)
+        r.reason = response.reason_phrase
+        r.url = str(response.url)
+        r.raw = _Http2Raw(response, self)
+        if not stream:
+            try:
+                r.content
+            finally:
+                self.run(response.aclose())
+        return r
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        self.run(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
 class ScalewayClient(object):
-    def __init__(self, token, id, create_zone):
+    PAGE_SIZE = 1000
+    STREAM_CHUNK_SIZE = 64 * 1024
+    # name -> callable returning a transport sending the requests with the
+    # default headers given: an object with the request method of a
+    # requests Session, returning requests Responses
+    TRANSPORTS = {
+        'requests': _requests_transport,
+        'http2': _Http2Transport,
+    }
+
+    def __init__(self, token, id, create_zone, max_concurrency=32,
+                 adaptive_concurrency=False, rate_limit=None,
+                 rate_limit_burst=None, rate_limit_path=None,
+                 hedge_percentile=None, hedge_budget=0.05, deadline=None,
+                 transport='requests'):
         self.log = getLogger(f'ScalewayClient[{id}]')
-        session = Session()
-        session.headers.update({'x-auth-token': token})
-        self._session = session
+        try:
+            transport = self.TRANSPORTS[transport]
+        except KeyError:
+            raise ScalewayClientException(
+                f'Unknown transport {transport}, expected one of '
+                f'{", ".join(self.TRANSPORTS)}')
+        self._transport = transport({'x-auth-token': token})
         self.endpoint = f'https://api.scaleway.com/domain/{__API_VERSION__}'
         self.create_zone = create_zone
+        # monotonic time past which no request is sent, but by the threads
+        # in without_deadline
+        self.deadline = deadline
+        self._local = local()
+
+        self._metrics = defaultdict(int)
+        self._metrics_lock = Lock()
+        self._limiter = None
+        if adaptive_concurrency:
+            self._limiter = _AimdLimiter(max_concurrency)
+        self._breaker = _CircuitBreaker()
+        self._hedger = None
+        if hedge_percentile is not None:
+            self._hedger = _Hedger(hedge_percentile, hedge_budget,
+                                   2 * max_concurrency)
+        self._bucket = None
+        if rate_limit is not None:
+            # a bucket per account, shared by the processes of the host
+            self._bucket = _SharedTokenBucket(
+                rate_limit_path or
+                os.path.join(gettempdir(), 'octodns-scaleway-rate-limit.db'),
+                sha256(str(token).encode()).hexdigest()[:16], rate_limit,
+                rate_limit_burst or rate_limit)
+
+    def close(self):
+        '''
+        Closes the connections of the transport, and the event loop of the
+        http2 one
+        '''
+        self._transport.close()
+
+    @property
+    def metrics(self):
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        if self._limiter is not None:
+            metrics['concurrency_limit'] = self._limiter.limit
+        return metrics
+
+    def _record_metric(self, name, value):
+        with self._metrics_lock:
+            self._metrics[name] += value
+
+    @contextmanager
+    def without_deadline(self):
+        '''
+        Lets the requests of the calling thread through regardless of the
+        deadline
+        '''
+        self._local.unbounded = True
+        try:
+            yield
+        finally:
+            self._local.unbounded = False
+
+    def _thread_deadline(self):
+        if getattr(self._local, 'unbounded', False):
+            return None
+        return self.deadline
+
+    def _remaining(self, deadline):
+        '''
+        Returns the seconds left before deadline, None without one. Raises
+        ScalewayClientDeadlineExceeded once it passed.
+        '''
+        if deadline is None:
+            return None
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            raise ScalewayClientDeadlineExceeded()
+        return remaining
+
+    def _transmit(self, deadline, *args, **kwargs):
+        # the timeout is computed when sending, after the waits for a token
+        # and a slot
+        try:
+            return self._transport.request(*args,
+                                           timeout=self._remaining(deadline),
+                                           **kwargs)
+        except Timeout as e:
+            if deadline is not None and monotonic() >= deadline:
+                raise ScalewayClientDeadlineExceeded() from e
+            raise
+
+    def _send(self, method, url, kind, deadline, stream=False, **kwargs):
+        '''
+        Sends a request, or a hedge of one, once it got a rate limit token and
+        a concurrency slot
+        '''
+        remaining = self._remaining(deadline)
+        if self._bucket is not None:
+            wait = self._bucket.reserve()
+            if remaining is not None and wait >= remaining:
+                # no point in waiting for a slot past the deadline
+                raise ScalewayClientDeadlineExceeded()
+            if wait:
+                self._record_metric('rate_limited_seconds', wait)
+                sleep(wait)
+        if self._limiter is None:
+            return self._transmit(deadline, method, url, stream=stream,
+                                  **kwargs)
+
+        generation = self._limiter.acquire(self._remaining(deadline))
+        if generation is None:
+            raise ScalewayClientDeadlineExceeded()
+        start = perf_counter()
+        status_code = None
+        try:
+            r = self._transmit(deadline, method, url, stream=stream,
+                               **kwargs)
+            status_code = r.status_code
+        finally:
+            healthy = status_code is not None and status_code < 500 and \
+                status_code != 429
+            release = partial(self._limiter.release, generation,
+                              perf_counter() - start, healthy, kind)
+            if stream and status_code is not None and status_code < 400:
+                # the slot is held until the body streamed has been read,
+                # the response closed
+                self._release_on_close(r, release)
+            else:
+                release()
+        return r
 
-    def _request(self, method, path, params={}, data=None):
+    def _request(self, method, path, params={}, data=None, stream=False):
         url = f'{self.endpoint}{path}'
-        r = self._session.request(method, url, params=params, json=data)
+        headers = {}
+        # a hedge is sent from another thread
+        deadline = self._thread_deadline()
+        self._remaining(deadline)
+        if data is not None:
+            data = _dumps(data)
+            headers['content-type'] = 'application/json'
+            self._record_metric('bytes_sent', len(data))
+        try:
+            self._breaker.check()
+        except ScalewayClientCircuitOpen:
+            self._record_metric('circuit_rejected', 1)
+            raise
+        kind = _request_kind(method, path, params)
+        try:
+            send = partial(self._send, method, url, kind, deadline,
+                           params=params, data=data, headers=headers,
+                           stream=stream)
+            # only the reads are idempotent
+            if self._hedger is not None and method == 'GET':
+                r, hedges, won = self._hedger.send(send, kind)
+                self._record_metric('hedges', hedges)
+                self._record_metric('hedge_wins', won)
+            else:
+                r = send()
+        except ScalewayClientDeadlineExceeded:
+            # out of time on our side, not a failure of the API
+            self._breaker.cancel()
+            raise
+        except BaseException:
+            self._breaker.record(False)
+            raise
+        self._breaker.record(r.status_code < 500)
+        self._record_metric('requests', 1)
+        if r.status_code == 429:
+            self._record_metric('throttled', 1)
+        if not stream:
+            # bytes pulled over the wire, before any content decoding
+            self._record_metric('bytes_received', r.raw.tell())
         if r.status_code == 400:
             raise ScalewayClientBadRequest()
         if r.status_code == 401:
@@ -73,20 +812,333 @@ class ScalewayClient(object):
         r.raise_for_status()
         return r
 
+    def _release_on_close(self, r, release):
+        close = r.close
+
+        def close_and_release():
+            # only released once
+            r.close = close
+            try:
+                close()
+            finally:
+                release()
+
+        r.close = close_and_release
+
+    def _json(self, r):
+        content = r.content
+        start = perf_counter()
+        data = _loads(content)
+        self._record_metric('decode_seconds', perf_counter() - start)
+        self._record_metric('bytes_decoded', len(content))
+        return data
+
+    def _last_page(self, page, count, total_count):
+        return count < self.PAGE_SIZE or \
+            (total_count is not None and page * self.PAGE_SIZE >= total_count)
+
+    def _records_page(self, zone_name, page, stream=False, filters={}):
+        return self._request('GET', f'/dns-zones/{zone_name}/records',
+                             params=dict(filters, page=page,
+                                         page_size=self.PAGE_SIZE),
+                             stream=stream)
+
     def zone_records(self, zone_name):
-        try:
-            return self._request('GET', f'/dns-zones/{zone_name}/records'
-                                 '?page_size=1000').json()['records']
-        except ScalewayClientForbidden:
-            return []
+        return self.get_records(zone_name)
+
+    def _filters(self, name, type):
+        filters = {}
+        # an empty name is the same as no name for the API, the apex records
+        # have to be filtered on our side
+        if name:
+            filters['name'] = name
+        if type is not None:
+            filters['type'] = type
+        return filters
+
+    def get_records(self, zone_name, name=None, type=None):
+        '''
+        Returns the records of the zone, only those with the given name
+        and/or type when set, filtered by the API.
+        '''
+        filters = self._filters(name, type)
+        records = []
+        page = 1
+        while True:
+            try:
+                r = self._records_page(zone_name, page, filters=filters)
+            except ScalewayClientForbidden:
+                # a missing zone, a truncated one past the first page
+                if page > 1:
+                    raise
+                return []
+            data = self._json(r)
+            records.extend(data['records'])
+            if self._last_page(page, len(data['records']),
+                               data.get('total_count')):
+                break
+            page += 1
+
+        if name is not None:
+            records = [r for r in records if r['name'] == name]
+        return records
+
+    def iter_zone_records(self, zone_name, name=None, type=None,
+                          missing_ok=True):
+        '''
+        Yields the records of the zone while they are read off the socket,
+        only one record at a time being held decoded. name and type filter
+        them as in get_records. A missing zone has no records, unless
+        missing_ok is False when ScalewayClientForbidden is raised.
+        '''
+        filters = self._filters(name, type)
+        page = 1
+        while True:
+            try:
+                r = self._records_page(zone_name, page, stream=True,
+                                       filters=filters)
+            except ScalewayClientForbidden:
+                # a missing zone, a truncated one past the first page
+                if page > 1 or not missing_ok:
+                    raise
+                return
+
+            stream = _JsonStream(r.iter_content(self.STREAM_CHUNK_SIZE))
+            count = 0
+            try:
+                for record in stream.items('records'):
+                    count += 1
+                    if name is None or record['name'] == name:
+                        yield record
+            finally:
+                r.close()
+                self._record_metric('bytes_received', r.raw.tell())
+                self._record_metric('bytes_decoded', stream.bytes)
+                self._record_metric('decode_seconds', stream.decode_seconds)
+
+            if self._last_page(page, count,
+                               stream.members.get('total_count')):
+                return
+            page += 1
 
     def record_updates(self, zone_name, data):
         self.log.debug(f'record_updates: zone_name={zone_name}, data={data}')
         self._request('PATCH', f'/dns-zones/{zone_name}/records',
                       data=data)
 
+    def import_bind_zone(self, zone_name, content):
+        '''
+        Replaces the records of the zone with the ones of a BIND zone file
+        '''
+        self.log.debug('import_bind_zone: zone_name=%s, len(content)=%d',
+                       zone_name, len(content))
+        self._request('POST', f'/dns-zones/{zone_name}/raw',
+                      data={'bind_source': {'content': content}})
+
+    def export_snapshot(self, zone_names, path):
+        '''
+        Writes the records of the zones to a gzip compressed snapshot: a
+        header line then a line per zone, written record by record while
+        they are streamed. Returns the names of the zones written, the
+        missing ones are skipped.
+        '''
+        exported = []
+        with gzip_open(path, 'wb') as fh:
+            fh.write(_dumps({
+                'format': __SNAPSHOT_FORMAT__,
+                'version': __SNAPSHOT_VERSION__,
+            }) + b'\n')
+            for zone_name in zone_names:
+                records = self.iter_zone_records(zone_name, missing_ok=False)
+                try:
+                    record = next(records, None)
+                except (ScalewayClientForbidden, ScalewayClientNotFound):
+                    self.log.warning('export_snapshot: zone %s not found',
+                                     zone_name)
+                    continue
+
+                fh.write(_snapshot_zone_prefix(zone_name))
+                count = 0
+                while record is not None:
+                    if count:
+                        fh.write(b',')
+                    fh.write(_dumps(record))
+                    count += 1
+                    record = next(records, None)
+                fh.write(b']}\n')
+                self.log.info('export_snapshot: zone %s, %d records',
+                              zone_name, count)
+                exported.append(zone_name)
+        return exported
+
+
+# priority labels of the zones, the lowest rank going first
+_PRIORITIES = {'critical': 0, 'high': 1, 'normal': 2, 'low': 3}
+
+
+def _schedule(jobs, workers):
+    '''
+    Returns the keys of jobs, {key: (priority rank, cost)}, in the order to
+    start them on workers: by priority, then within a priority the jobs
+    longer than a worker's share of it, longest first so that they run along
+    the others, and the rest shortest first.
+    '''
+    order = []
+    for rank in sorted({rank for rank, _ in jobs.values()}):
+        costs = {key: cost for key, (r, cost) in jobs.items() if r == rank}
+        share = sum(costs.values()) / workers
+        order.extend(sorted((k for k, c in costs.items() if c > share),
+                            key=lambda k: -costs[k]))
+        order.extend(sorted((k for k, c in costs.items() if c <= share),
+                            key=costs.get))
+    return order
+
+
+def _snapshot_zone_prefix(zone_name):
+    return b'{"zone":' + _dumps(zone_name) + b',"records":['
+
+
+class _SnapshotClient(object):
+    '''
+    Serves the records of a snapshot written by
+    ScalewayClient.export_snapshot in place of the API. The snapshot is read
+    once, its lines kept encoded and indexed by zone, a zone being decoded
+    when asked for.
+    '''
+
+    def __init__(self, path, id):
+        self.log = getLogger(f'_SnapshotClient[{id}]')
+        self.path = path
+        # zone name -> (line, number of records)
+        self._zones = None
+        self._lock = Lock()
+
+    def _index(self):
+        with self._lock:
+            if self._zones is None:
+                zones = {}
+                with gzip_open(self.path, 'rb') as fh:
+                    header = _loads(fh.readline())
+                    if header.get('format') != __SNAPSHOT_FORMAT__ or \
+                            header.get('version', 0) > __SNAPSHOT_VERSION__:
+                        raise ScalewayProviderException(
+                            f'{self.path}: unsupported snapshot {header}')
+                    for line in fh:
+                        zone = _loads(line)
+                        zones[zone['zone']] = (line, len(zone['records']))
+                self.log.debug('_index: %d zones', len(zones))
+                self._zones = zones
+            return self._zones
+
+    def get_records(self, zone_name, name=None, type=None):
+        try:
+            line, _ = self._index()[zone_name]
+        except KeyError:
+            raise ScalewayClientNotFound()
+        records = _loads(line)['records']
+
+        return [r for r in records
+                if (name is None or r['name'] == name) and
+                (type is None or r['type'] == type)]
+
+    def zone_records(self, zone_name):
+        return self.get_records(zone_name)
+
+    def iter_zone_records(self, zone_name, name=None, type=None):
+        yield from self.get_records(zone_name, name, type)
+
+    def zone_sizes(self):
+        '''
+        Returns the number of records of each zone of the snapshot
+        '''
+        return {zone_name: size
+                for zone_name, (_, size) in self._index().items()}
+
+    def close(self):
+        # nothing is held open, the snapshot being read at once
+        pass
+
+
+class _ApplyJournal(object):
+    '''
+    Write-ahead journal of the changes sent to a zone towards a desired
+    state, JSON lines flushed to disk before and after each chunk so that an
+    interrupted apply resumes, whether the same plan is applied again or a
+    new one planned against the half-applied zone. The changes are journaled
+    by id, the hash of their parameters.
+    '''
+
+    def __init__(self, path, desired):
+        self.path = path
+        self.desired = desired
+        self.done = set()
+        self.started = set()
+        self.resumed = False
+
+        try:
+            with open(path, 'rb') as fh:
+                lines = [_loads(line) for line in fh if line.strip()]
+        except FileNotFoundError:
+            lines = []
+        if lines and lines[0].get('desired') == desired:
+            self.resumed = True
+            for line in lines[1:]:
+                getattr(self, line['state']).update(line['changes'])
+            self._fh = open(path, 'ab')
+        else:
+            # another desired state, what was journaled towards the previous
+            # one is moot
+            self._fh = open(path, 'wb')
+            self._write({'desired': desired})
+
+    def _write(self, entry):
+        self._fh.write(_dumps(entry) + b'\n')
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def mark(self, changes, state):
+        getattr(self, state).update(changes)
+        self._write({'changes': changes, 'state': state})
+
+    def close(self):
+        self._fh.close()
+
+    def complete(self):
+        self.close()
+        os.remove(self.path)
+
+
+def _data_for_groups(groups):
+    '''
+    Converts (name, type, records) groups of raw records to their octoDNS
+    data, in the populate process pool
+    '''
+    # the converters don't use any state of the provider
+    converter = ScalewayProvider.__new__(ScalewayProvider)
+    return [getattr(converter, f'_data_for_{_type}')(_type, records)
+            for _, _type, records in groups]
+
+
+def _records_for_groups(zone_name, groups):
+    '''
+    Builds and validates the octoDNS records of (name, type, records) groups
+    of raw records on a scratch zone, in the populate process pool. Returns
+    (data, record, None) for the valid groups and (data, None, reasons) for
+    the others, the records being bound to the actual zone by the parent.
+    '''
+    zone = Zone(zone_name, [])
+    ret = []
+    for (name, _, _), data in zip(groups, _data_for_groups(groups)):
+        try:
+            ret.append((data, Record.new(zone, name, data), None))
+        except ValidationError as e:
+            ret.append((data, None, e.reasons))
+    return ret
+
 
 class ScalewayProvider(BaseProvider):
+    # changes sent per PATCH when a bulk import falls back on them
+    CHUNK_SIZE = 500
     SUPPORTS_GEO = False
     SUPPORTS_DYNAMIC = True
     SUPPORTS_POOL_VALUE_STATUS = False
@@ -94,52 +1146,142 @@ class ScalewayProvider(BaseProvider):
                      'LOC', 'MX', 'NAPTR', 'NS', 'PTR', 'SPF',
                      'SRV', 'SSHFP', 'TXT']))
 
-    def __init__(self, id, token, create_zone=False, *args, **kwargs):
+    def __init__(self, id, token, create_zone=False, *args,
+                 bisect_on_bad_request=False, stream_records=False,
+                 types=None, include_names=None, bulk_import_threshold=1000,
+                 populate_processes=None, populate_process_threshold=10000,
+                 max_concurrency=32, adaptive_concurrency=False,
+                 rate_limit=None, rate_limit_burst=None,
+                 rate_limit_path=None, hedge_percentile=None,
+                 hedge_budget=0.05, cache_ttl=None, refresh_ahead=None,
+                 strict_freshness=False, journal_path=None, sync_timeout=None,
+                 zone_priorities=None, cost_snapshot=None,
+                 transport='requests', **kwargs):
         self.log = getLogger(f'ScalewayProvider[{id}]')
-        self.log.debug('__init__: id=%s, token=***, create_zone=%s', id,
-                       create_zone)
+        self.log.debug('__init__: id=%s, token=***, create_zone=%s, '
+                       'bisect_on_bad_request=%s, stream_records=%s, '
+                       'types=%s, include_names=%s, '
+                       'bulk_import_threshold=%s, populate_processes=%s, '
+                       'populate_process_threshold=%s, max_concurrency=%s, '
+                       'adaptive_concurrency=%s, rate_limit=%s, '
+                       'rate_limit_burst=%s, rate_limit_path=%s, '
+                       'hedge_percentile=%s, hedge_budget=%s, '
+                       'cache_ttl=%s, refresh_ahead=%s, '
+                       'strict_freshness=%s, journal_path=%s, '
+                       'sync_timeout=%s, zone_priorities=%s, '
+                       'cost_snapshot=%s, transport=%s', id, create_zone,
+                       bisect_on_bad_request, stream_records, types,
+                       include_names, bulk_import_threshold,
+                       populate_processes, populate_process_threshold,
+                       max_concurrency, adaptive_concurrency, rate_limit,
+                       rate_limit_burst, rate_limit_path, hedge_percentile,
+                       hedge_budget, cache_ttl, refresh_ahead,
+                       strict_freshness, journal_path, sync_timeout,
+                       zone_priorities, cost_snapshot, transport)
         super(ScalewayProvider, self).__init__(id, *args, **kwargs)
-        self._client = ScalewayClient(token, id, create_zone)
+        self.sync_timeout = sync_timeout
+        # started by the first zone read or planned, see _start_deadline
+        self._deadline = None
+        self._client = ScalewayClient(
+            token, id, create_zone, max_concurrency=max_concurrency,
+            adaptive_concurrency=adaptive_concurrency, rate_limit=rate_limit,
+            rate_limit_burst=rate_limit_burst, rate_limit_path=rate_limit_path,
+            hedge_percentile=hedge_percentile, hedge_budget=hedge_budget,
+            transport=transport)
+        self.bisect_on_bad_request = bisect_on_bad_request
+        self.stream_records = stream_records
+        self.bulk_import_threshold = bulk_import_threshold
+        self.populate_processes = populate_processes
+        self.populate_process_threshold = populate_process_threshold
+        self.cache_ttl = cache_ttl
+        # refreshed in the background during the last fifth of their ttl by
+        # default
+        if refresh_ahead is None and cache_ttl is not None:
+            refresh_ahead = cache_ttl / 5
+        if cache_ttl is not None and not 0 < refresh_ahead < cache_ttl:
+            # the refresher would spin, or refresh the zones continuously
+            raise ScalewayProviderException(
+                f'{id}: refresh_ahead {refresh_ahead} must be between 0 and '
+                f'cache_ttl {cache_ttl}')
+        self.refresh_ahead = refresh_ahead
+        self.strict_freshness = strict_freshness
+        self.journal_path = journal_path
+        self.zone_priorities = zone_priorities or {}
+        for zone_name, label in self.zone_priorities.items():
+            if label not in _PRIORITIES:
+                raise ScalewayProviderException(
+                    f'{id}: unknown priority {label} of {zone_name}, '
+                    f'expected one of {", ".join(_PRIORITIES)}')
+        self.cost_snapshot = cost_snapshot
+        # zone name -> number of records when last read, estimating the cost
+        # of reading it again, and in the cost snapshot once loaded
+        self._zone_sizes = {}
+        self._snapshot_sizes = None
+
+        # only manage some of the supported types, the others being left
+        # alone
+        self.types = None if types is None else self.SUPPORTS & set(types)
+        # only manage some of the names, `/regex/` or exact names
+        self.include_names = include_names
+        self._include_names_exact = set()
+        self._include_names_re = []
+        for name in include_names or []:
+            if len(name) > 1 and name.startswith('/') and name.endswith('/'):
+                self._include_names_re.append(re.compile(name[1:-1]))
+            else:
+                self._include_names_exact.add(name)
 
         self._zone_records = {}
+        # zone name -> Future of the fetch in flight, shared by the callers
+        # asking for the same zone while it runs
+        self._zone_records_fetches = {}
+        # zone name -> monotonic time of the fetch of its cached records
+        self._zone_records_fetched = {}
+        # zone name -> bumped by each apply, the fetches started before it
+        # aren't cached
+        self._zone_generations = defaultdict(int)
+        self._zone_records_lock = Lock()
+        self._refresh_executor = None
+        self._populate_executor = None
+        self._refresher_thread = None
+        self._refresher_stop = Event()
+        # zone name -> {(name, type): (hash of the raw records, Record class,
+        # data)} of the record sets that validated, reused while their raw
+        # records don't change
+        self._rrset_data = {}
+        # the zones planned with changes which haven't been applied yet
+        self._unfinished_zones = set()
+        # the (zone name, target) read by the current sync
+        self._sync_zones = set()
 
     def _data_dynamic_geo(self, geo_ip_config):
         pools = {}
         rules = []
 
+        # merge the sames matches for multiple values, the raw records are
+        # left untouched as they may be cached and shared between threads
         matches = []
-        # merge the sames matches for multiple values
         for match in geo_ip_config['matches']:
-            match['datas'] = []
-            found = False
-            for _match in matches:
-                shared_items = {
-                    k: match[k]
-                    for k in match if k in _match and match[k] == _match[k]
-                }
-
-                # compare if the match have the same number of keys
-                # ans if they are shared all they items but data and datas
-                if len(match.keys()) == len(_match.keys()) \
-                   and len(shared_items) == len(_match.keys()) - 2:
-                    _match['datas'].append(match['data'])
-                    found = True
+            for _match, datas in matches:
+                # same keys and items but a different data
+                if match.keys() == _match.keys() and \
+                   match['data'] != _match['data'] and \
+                   all(match[k] == _match[k] for k in match if k != 'data'):
+                    datas.append(match['data'])
                     break
-
-            if not found:
-                match['datas'] = [match['data']]
-                matches.append(match)
+            else:
+                matches.append((match, [match['data']]))
 
         # rules
         n = 0
         fallback = None
-        for match in matches:
+        for match, _ in matches:
             geos = []
             if 'countries' in match and len(match['countries']):
                 for country in match['countries']:
                     geos.append(GeoCodes.country_to_code(country))
             else:
-                geos = match['continents']
+                geos = list(match['continents'])
 
             rules.append({
                 'pool': f'pool-{n}',
@@ -147,7 +1289,7 @@ class ScalewayProvider(BaseProvider):
             })
             n += 1
 
-        if geo_ip_config['default']:
+        if geo_ip_config.get('default'):
             fallback = f'pool-{n}'
             rules.append({
                 'pool': fallback
@@ -155,9 +1297,9 @@ class ScalewayProvider(BaseProvider):
 
         # pools
         n = 0
-        for match in matches:
+        for _, datas in matches:
             values = []
-            for data in match['datas']:
+            for data in datas:
                 values.append({
                     'value': data,
                     'weight': 1,
@@ -427,49 +1569,510 @@ class ScalewayProvider(BaseProvider):
             'values': values
         }
 
+    _txt_chunk_re = re.compile(r'"((?:[^"\\]|\\.)*)"')
+    _txt_semicolon_re = re.compile(r'(?<!\\);')
+
+    def _txt_value(self, data):
+        if data.startswith('"'):
+            # join the character-strings, octoDNS keeps every escaping but
+            # the quotes
+            data = ''.join(chunk.replace('\\"', '"')
+                           for chunk in self._txt_chunk_re.findall(data))
+        # octoDNS expects escaped semicolons
+        return self._txt_semicolon_re.sub(r'\\;', data)
+
     def _data_for_TXT(self, _type, records):
         return {
             'ttl': records[0]['ttl'],
             'type': _type,
-            'values': [records[0]['data']]
+            'values': [self._txt_value(record['data']) for record in records]
         }
 
     _data_for_SPF = _data_for_TXT
 
-    def zone_records(self, zone):
-        if zone.name not in self._zone_records:
-            try:
-                self._zone_records[zone.name] = \
-                    self._client.zone_records(zone.name[:-1])
-            except ScalewayClientNotFound:
-                return []
+    def _managed_name(self, name):
+        if self.include_names is None:
+            return True
+        return name in self._include_names_exact or \
+            any(r.search(name) for r in self._include_names_re)
+
+    def _managed_type(self, _type):
+        return self.types is None or _type in self.types
+
+    def _server_type(self, _type):
+        # SPF records are stored as TXT
+        return 'TXT' if _type == 'SPF' else _type
+
+    def _shared_type(self, _type):
+        # SPF alone is managed, its records sharing the TXT sets with values
+        # that are left alone
+        server_type = self._server_type(_type)
+        return server_type != _type and not self._managed_type(server_type)
+
+    def _server_types(self):
+        return set(self._server_type(t) for t in self.types or self.SUPPORTS)
+
+    def _read_type(self, record):
+        '''
+        Returns the type the raw record is read as, None when it isn't
+        managed
+        '''
+        _type = record['type']
+        if _type == 'TXT' and not self._managed_type('TXT'):
+            # SPF alone is managed, read back from the TXT records holding
+            # SPF policies
+            if self._managed_type('SPF') and \
+               self._txt_value(record['data']).startswith('v=spf1'):
+                return 'SPF'
+            return None
+        if _type not in self.SUPPORTS or not self._managed_type(_type):
+            return None
+        return _type
+
+    def _record_filters(self):
+        '''
+        Returns the API filters of the queries reading the managed records
+        '''
+        types = self._server_types()
+        _type = types.pop() if len(types) == 1 else None
+        if self.include_names is None or self._include_names_re:
+            names = [None]
+        else:
+            names = sorted(self._include_names_exact)
+        return [{k: v for k, v in (('name', name), ('type', _type))
+                 if v is not None} for name in names]
+
+    def _fetch_zone_records(self, zone_name):
+        records = []
+        for filters in self._record_filters():
+            if self.stream_records:
+                fetched = self._client.iter_zone_records(zone_name, **filters)
+            elif filters:
+                fetched = self._client.get_records(zone_name, **filters)
+            else:
+                fetched = self._client.zone_records(zone_name)
+            # drop what isn't managed as soon as possible
+            records.extend(r for r in fetched
+                           if self._read_type(r) is not None and
+                           self._managed_name(r['name']))
+        return records
+
+    def _fetch(self, zone_name):
+        '''
+        Fetches the records of the zone into the cache, joining the fetch in
+        flight if any
+        '''
+        with self._zone_records_lock:
+            fetch = self._zone_records_fetches.get(zone_name)
+            if fetch is None:
+                fetch = Future()
+                self._zone_records_fetches[zone_name] = fetch
+                leader = True
+            else:
+                leader = False
+            generation = self._zone_generations[zone_name]
 
-        return self._zone_records[zone.name]
+        if not leader:
+            self.log.debug('zone_records: waiting for the fetch of %s',
+                           zone_name)
+            return fetch.result()
+
+        try:
+            records = self._fetch_zone_records(zone_name[:-1])
+        except ScalewayClientNotFound:
+            with self._zone_records_lock:
+                if self._fetch_done(zone_name, fetch, generation):
+                    self._zone_records.pop(zone_name, None)
+            fetch.set_result([])
+            return []
+        except Exception as e:
+            with self._zone_records_lock:
+                self._fetch_done(zone_name, fetch, generation)
+            fetch.set_exception(e)
+            raise
+
+        with self._zone_records_lock:
+            if self._fetch_done(zone_name, fetch, generation):
+                self._zone_records[zone_name] = records
+                self._zone_records_fetched[zone_name] = monotonic()
+                self._zone_sizes[zone_name] = len(records)
+        fetch.set_result(records)
+        return records
+
+    def _fetch_done(self, zone_name, fetch, generation):
+        '''
+        Ends the fetch, returning whether its result can be cached: no apply
+        to the zone happened since it started. Under _zone_records_lock.
+        '''
+        # an apply forgets the fetch in flight, a new one may have started
+        if self._zone_records_fetches.get(zone_name) is fetch:
+            self._zone_records_fetches.pop(zone_name)
+        if self._zone_generations[zone_name] != generation:
+            self.log.debug('_fetch: %s was applied meanwhile, not cached',
+                           zone_name)
+            return False
+        return True
+
+    def _refresh(self, zone_name):
+        try:
+            # a background refresh isn't part of any sync
+            with self._client.without_deadline():
+                self._fetch(zone_name)
+        except Exception:
+            # the stale copy is served until a refresh succeeds
+            self.log.warning('_refresh: refresh of %s failed', zone_name,
+                             exc_info=True)
+
+    def _refresh_in_background(self, zone_name):
+        # under _zone_records_lock
+        if zone_name in self._zone_records_fetches:
+            return
+        self.log.debug('_refresh_in_background: zone=%s', zone_name)
+        if self._refresh_executor is None:
+            self._refresh_executor = ThreadPoolExecutor(
+                4, thread_name_prefix='refresh')
+        self._refresh_executor.submit(self._refresh, zone_name)
+
+    def _refresher(self):
+        # refreshes the cached zones about to expire
+        while not self._refresher_stop.wait(self.refresh_ahead / 2):
+            with self._zone_records_lock:
+                due = monotonic() - self.cache_ttl + self.refresh_ahead
+                for zone_name in list(self._zone_records):
+                    if self._zone_records_fetched[zone_name] <= due:
+                        self._refresh_in_background(zone_name)
+
+    def close(self):
+        '''
+        Stops the background refresh of the cached zones and the populate
+        process pool, and closes the connections to the API
+        '''
+        self._refresher_stop.set()
+        if self._refresh_executor is not None:
+            self._refresh_executor.shutdown()
+        if self._populate_executor is not None:
+            self._populate_executor.shutdown()
+        self._client.close()
+
+    def zone_records(self, zone, fresh=None):
+        '''
+        Returns the raw records of the zone, from the cache when they are
+        there. Once they expired, after cache_ttl, the stale copy is returned
+        while they are refreshed in the background, unless fresh, which
+        defaults to strict_freshness, is set.
+        '''
+        if fresh is None:
+            fresh = self.strict_freshness
+        with self._zone_records_lock:
+            cached = self._zone_records.get(zone.name)
+            if cached is not None:
+                if self.cache_ttl is None:
+                    return cached
+                age = monotonic() - self._zone_records_fetched[zone.name]
+                if age < self.cache_ttl or not fresh:
+                    if age >= self.cache_ttl - self.refresh_ahead:
+                        self._refresh_in_background(zone.name)
+                    return cached
+                self.log.debug('zone_records: %s expired', zone.name)
+            if self.cache_ttl is not None and self._refresher_thread is None:
+                self._refresher_thread = Thread(target=self._refresher,
+                                                name='refresher', daemon=True)
+                self._refresher_thread.start()
+
+        return self._fetch(zone.name)
+
+    def _priority(self, zone_name):
+        return _PRIORITIES[self.zone_priorities.get(zone_name, 'normal')]
+
+    def _read_costs(self, zone_names):
+        '''
+        Returns the estimated cost of reading each zone, its number of records
+        when last read or in the cost snapshot, the average of the known ones
+        for the others
+        '''
+        if self.cost_snapshot is not None and self._snapshot_sizes is None:
+            snapshot = _SnapshotClient(self.cost_snapshot, self.id)
+            self._snapshot_sizes = {
+                f'{zone_name}.': size
+                for zone_name, size in snapshot.zone_sizes().items()
+            }
+        sizes = dict(self._snapshot_sizes or {})
+        with self._zone_records_lock:
+            sizes.update(self._zone_sizes)
+        known = [sizes[z] for z in zone_names if z in sizes]
+        default = sum(known) / len(known) if known else 1
+        return {z: sizes.get(z, default) for z in zone_names}
+
+    def prefetch(self, zone_names, workers=8):
+        '''
+        Reads the records of the zones into the cache on workers threads,
+        the critical zones first and then by estimated size, see _schedule.
+        Returns the names of the zones which couldn't be read.
+        '''
+        costs = self._read_costs(zone_names)
+        order = _schedule({z: (self._priority(z), costs[z])
+                           for z in zone_names}, workers)
+        self.log.debug('prefetch: order=%s', order)
+        self._start_deadline()
+
+        def read(zone_name):
+            self._check_deadline(zone_name)
+            self.zone_records(Zone(zone_name, []))
+
+        failed = []
+        with ThreadPoolExecutor(workers,
+                                thread_name_prefix='prefetch') as executor:
+            futures = [(z, executor.submit(read, z)) for z in order]
+            for zone_name, future in futures:
+                if future.exception() is not None:
+                    self.log.warning('prefetch: reading %s failed (%s)',
+                                     zone_name, future.exception())
+                    failed.append(zone_name)
+        return failed
+
+    def apply_plans(self, plans, workers=8):
+        '''
+        Applies the plans on workers threads, the critical zones first and
+        then by number of changes, see _schedule. Returns the number of
+        changes made, raises the first failure once every plan was tried.
+        Plans of the same zone are refused before anything is applied.
+        '''
+        by_zone = {}
+        duplicates = set()
+        for plan in plans:
+            if plan.desired.name in by_zone:
+                duplicates.add(plan.desired.name)
+            by_zone[plan.desired.name] = plan
+        if duplicates:
+            raise ScalewayProviderException('Several plans for '
+                                            f'{", ".join(sorted(duplicates))}')
+        order = _schedule({z: (self._priority(z), len(p.changes))
+                           for z, p in by_zone.items()}, workers)
+        self.log.debug('apply_plans: order=%s', order)
+
+        with ThreadPoolExecutor(workers,
+                                thread_name_prefix='apply') as executor:
+            futures = [(z, executor.submit(self.apply, by_zone[z]))
+                       for z in order]
+            changes = 0
+            failure = None
+            for zone_name, future in futures:
+                if future.exception() is None:
+                    changes += future.result()
+                    continue
+                self.log.error('apply_plans: applying %s failed (%s)',
+                               zone_name, future.exception())
+                if failure is None:
+                    failure = future.exception()
+        if failure is not None:
+            raise failure
+        return changes
+
+    def refresh_rrset(self, zone, name, _type):
+        '''
+        Reads a single record set from the API, replacing it in the cached
+        records of the zone, and returns it as a Record, None when it doesn't
+        exist.
+        '''
+        self.log.debug('refresh_rrset: zone=%s, name=%s, type=%s', zone.name,
+                       name, _type)
+        server_type = self._server_type(_type)
+        records = self._client.get_records(zone.name[:-1], name=name,
+                                           type=server_type)
+
+        with self._zone_records_lock:
+            cached = self._zone_records.get(zone.name)
+            if cached is not None:
+                self._zone_records[zone.name] = [
+                    r for r in cached
+                    if r['name'] != name or r['type'] != server_type
+                ] + records
+
+        # e.g. the SPF values among the TXT ones
+        records = [r for r in records if self._read_type(r) == _type]
+        if not records:
+            return None
+        data = getattr(self, f'_data_for_{_type}')(_type, records)
+        return Record.new(zone, name, data, source=self, lenient=True)
+
+    def _data_for_groups(self, groups):
+        '''
+        Converts (name, type, records) groups of raw records to their octoDNS
+        data in-process, with the converters of the provider
+        '''
+        return [getattr(self, f'_data_for_{_type}')(_type, records)
+                for _, _type, records in groups]
+
+    def _groups_records(self, zone, groups, lenient):
+        '''
+        Returns the (record, data) of the groups of raw records, converted,
+        built and validated on the process pool for large zones when enabled.
+        data is None for the invalid records built when lenient, which aren't
+        reused.
+        '''
+        count = sum(len(records) for _, _, records in groups)
+        if not groups or self.populate_processes is None or \
+           count < self.populate_process_threshold:
+            ret = []
+            for (name, _, _), data in zip(groups,
+                                          self._data_for_groups(groups)):
+                try:
+                    ret.append((Record.new(zone, name, data, source=self),
+                                data))
+                except ValidationError:
+                    if not lenient:
+                        raise
+                    ret.append((Record.new(zone, name, data, source=self,
+                                           lenient=True), None))
+            return ret
+
+        # a few batches per process to even out their load while keeping the
+        # pickling overhead low
+        size = -(-len(groups) // (self.populate_processes * 4))
+        batches = [groups[i:i + size] for i in range(0, len(groups), size)]
+        self.log.debug('_groups_records: %d records in %d batches on %d '
+                       'processes', count, len(batches),
+                       self.populate_processes)
+        with self._zone_records_lock:
+            # kept for the lifetime of the provider, see close
+            if self._populate_executor is None:
+                # the workers aren't forked off a process running the
+                # refresher, hedging and HTTP/2 threads
+                self._populate_executor = ProcessPoolExecutor(
+                    self.populate_processes,
+                    mp_context=get_context('spawn'))
+            executor = self._populate_executor
+        ret = []
+        for batch in executor.map(partial(_records_for_groups, zone.name),
+                                  batches):
+            for (name, _, _), (data, record, reasons) in \
+                    zip(groups[len(ret):], batch):
+                if record is not None:
+                    record.zone = zone
+                    record.source = self
+                    ret.append((record, data))
+                elif not lenient:
+                    fqdn = f'{name}.{zone.name}' if name else zone.name
+                    raise ValidationError(fqdn, reasons)
+                else:
+                    ret.append((Record.new(zone, name, data, source=self,
+                                           lenient=True), None))
+        return ret
+
+    def _deadline_exceeded(self, zone_name):
+        '''
+        Returns the exception reporting the zones not done, zone_name and the
+        ones planned but not applied
+        '''
+        with self._zone_records_lock:
+            zones = sorted(self._unfinished_zones | {zone_name})
+        self.log.error('deadline exceeded, zones not done: %s',
+                       ', '.join(zones))
+        return ScalewayProviderDeadlineExceeded(zones)
+
+    def _start_deadline(self, key=None):
+        # a sync starts with the first zone read or planned
+        with self._zone_records_lock:
+            if key is not None:
+                if key in self._sync_zones:
+                    # read again, the previous sync ended without applying
+                    # every zone planned, e.g. a plan only or no-change one
+                    self._end_sync()
+                self._sync_zones.add(key)
+            if self.sync_timeout is not None and self._deadline is None:
+                self._deadline = monotonic() + self.sync_timeout
+                self._client.deadline = self._deadline
+
+    def _end_sync(self):
+        # the next zone read starts a sync with a deadline of its own, the
+        # lock being held
+        self._deadline = None
+        self._client.deadline = None
+        self._unfinished_zones.clear()
+        self._sync_zones.clear()
+
+    def end_sync(self):
+        '''
+        Ends the current sync, forgetting its deadline and the zones planned
+        but not applied
+        '''
+        with self._zone_records_lock:
+            self._end_sync()
+
+    def _zone_applied(self, zone_name):
+        with self._zone_records_lock:
+            self._unfinished_zones.discard(zone_name)
+            if not self._unfinished_zones:
+                # the sync is over
+                self._end_sync()
+
+    def _check_deadline(self, zone_name):
+        # no new operation is started past the deadline
+        if self._deadline is not None and monotonic() >= self._deadline:
+            raise self._deadline_exceeded(zone_name)
 
     def populate(self, zone, target=False, lenient=False):
         self.log.debug('populate: name=%s, target=%s, lenient=%s', zone.name,
                        target, lenient)
 
+        self._start_deadline((zone.name, target))
+        self._check_deadline(zone.name)
+        try:
+            zone_records = self.zone_records(zone)
+        except ScalewayClientDeadlineExceeded as e:
+            raise self._deadline_exceeded(zone.name) from e
         values = defaultdict(lambda: defaultdict(list))
-        for record in self.zone_records(zone):
-            _type = record['type']
-            if _type not in self.SUPPORTS:
+        for record in zone_records:
+            # the record sets refreshed may not be managed, neither their
+            # type nor their name
+            _type = self._read_type(record)
+            if _type is None or not self._managed_name(record['name']):
                 continue
-            values[record['name']][record['type']].append(record)
+            values[record['name']][_type].append(record)
 
-        before = len(zone.records)
+        cached = self._rrset_data.get(zone.name, {})
+        rrset_data = {}
+        built = []
+        groups = []
         for name, types in values.items():
             for _type, records in types.items():
-                data = getattr(self, f'_data_for_{_type}')(_type, records)
-                record = Record.new(zone, name, data,
-                                    source=self, lenient=lenient)
-                zone.add_record(record, lenient=lenient)
+                key = (name, _type)
+                digest = sha256(_dumps(records)).digest()
+                hit = cached.get(key)
+                if hit is not None and hit[0] == digest:
+                    # unchanged, neither converted nor validated again
+                    rrset_data[key] = hit
+                    built.append(hit[1](zone, name, hit[2], source=self))
+                else:
+                    groups.append((name, _type, records, digest))
+        self.log.debug('populate:   %d record sets reused, %d built',
+                       len(built), len(groups))
+
+        for (name, _type, _, digest), (record, data) in \
+                zip(groups, self._groups_records(zone, [g[:3] for g in groups],
+                                                 lenient)):
+            if data is not None:
+                rrset_data[(name, _type)] = (digest, record.__class__, data)
+            built.append(record)
+        self._rrset_data[zone.name] = rrset_data
+
+        before = len(zone.records)
+        for record in built:
+            zone.add_record(record, lenient=lenient)
 
         exists = zone.name in self._zone_records
         self.log.info('populate:   found %s records, exists=%s',
                       len(zone.records) - before, exists)
         return exists
 
+    def plan(self, desired, processors=[]):
+        plan = super(ScalewayProvider, self).plan(desired,
+                                                  processors=processors)
+        if plan is not None:
+            with self._zone_records_lock:
+                self._unfinished_zones.add(desired.name)
+        return plan
+
     def _record_name(self, name):
         return name if name else '@'
 
@@ -478,7 +2081,9 @@ class ScalewayProvider(BaseProvider):
         if getattr(record, 'dynamic', False):
             dynamic = self._params_dynamic(record)
 
-        records = getattr(self, f'_params_for_{record._type}')(record)
+        # the _params_for_ methods rewrite the values, the plan must stay
+        # intact to be applied again, e.g. after a failed bulk import
+        records = getattr(self, f'_params_for_{record._type}')(record.copy())
         if dynamic and len(records):
             records = [records[0] | dynamic]
 
@@ -488,7 +2093,7 @@ class ScalewayProvider(BaseProvider):
         return {
             'delete': {
                 'idFields': {
-                    'type': record.record._type,
+                    'type': self._server_type(record.record._type),
                     'name': record.record.name
                 }
             }
@@ -498,13 +2103,37 @@ class ScalewayProvider(BaseProvider):
         return {
             'set': {
                 'idFields': {
-                    'type': record.record._type,
+                    'type': self._server_type(record.record._type),
                     'name': record.record.name
                 },
                 'records': self._params(record.new)
             }
         }
 
+    def _params_values(self, existing, new):
+        '''
+        Returns the per-value delete and add changes turning the records of
+        existing into the ones of new, either being None, for the types
+        sharing their sets with values that aren't managed
+        '''
+        old = self._params(existing) if existing is not None else []
+        records = self._params(new) if new is not None else []
+        kept = set(self._rrset_hash([r]) for r in old) & \
+            set(self._rrset_hash([r]) for r in records)
+        changes = [{
+            'delete': {
+                'idFields': {
+                    'type': r['type'],
+                    'name': existing.name,
+                    'data': r['data']
+                }
+            }
+        } for r in old if self._rrset_hash([r]) not in kept]
+        added = [r for r in records if self._rrset_hash([r]) not in kept]
+        if added:
+            changes.append({'add': {'records': added}})
+        return changes
+
     def _params_create(self, record):
         return {
             'add': {
@@ -531,7 +2160,6 @@ class ScalewayProvider(BaseProvider):
     _params_for_A = _params_for_multiple
     _params_for_AAAA = _params_for_multiple
     _params_for_NS = _params_for_multiple
-    _params_for_TXT = _params_for_multiple
 
     _params_for_ALIAS = _params_for_single
     _params_for_CNAME = _params_for_single
@@ -568,6 +2196,11 @@ class ScalewayProvider(BaseProvider):
         record._type = 'TXT'
         return self._params_for_TXT(record)
 
+    def _params_for_TXT(self, record):
+        # quoted character-strings of at most 255 characters
+        record.values = record.chunked_values
+        return self._params_for_multiple(record)
+
     def _params_for_SRV(self, record):
         record.values = [f'{v.priority} {v.weight} {v.port} {v.target}'
                          for v in record.values]
@@ -679,6 +2312,176 @@ class ScalewayProvider(BaseProvider):
 
         return values
 
+    _validate_caa_re = re.compile(r'^(\d+) ([a-zA-Z0-9]+) "(.*)"$')
+    _validate_loc_re = re.compile(r'^(\d+) (\d+) (\d+(?:\.\d+)?) ([NS]) '
+                                  r'(\d+) (\d+) (\d+(?:\.\d+)?) ([EW]) '
+                                  r'(-?\d+(?:\.\d+)?)m (\d+(?:\.\d+)?)m '
+                                  r'(\d+(?:\.\d+)?)m (\d+(?:\.\d+)?)m$')
+    _validate_mx_re = re.compile(r'^(\d+) (\S+)$')
+    _validate_naptr_re = re.compile(r'^(\d+) (\d+) "([^"]*)" "([^"]*)" '
+                                    r'"(.*)" (\S+)$')
+    _validate_srv_re = re.compile(r'^(\d+) (\d+) (\d+) (\S+)$')
+    _validate_sshfp_re = re.compile(r'^(\d+) (\d+) ([0-9a-fA-F]+)$')
+    _validate_target_re = re.compile(r'^\S+$')
+
+    def _validate_ranges(self, values, ranges):
+        reasons = []
+        for value, (label, low, high) in zip(values, ranges):
+            if not low <= float(value) <= high:
+                reasons.append(f'{label} {value} out of range')
+        return reasons
+
+    def _validate_for_A(self, data):
+        try:
+            IPv4Address(data)
+        except ValueError:
+            return ['not a valid IPv4 address']
+        return []
+
+    def _validate_for_AAAA(self, data):
+        try:
+            IPv6Address(data)
+        except ValueError:
+            return ['not a valid IPv6 address']
+        return []
+
+    def _validate_for_target(self, data):
+        if not self._validate_target_re.match(data):
+            return ['not a valid target']
+        return []
+
+    _validate_for_ALIAS = _validate_for_target
+    _validate_for_CNAME = _validate_for_target
+    _validate_for_DNAME = _validate_for_target
+    _validate_for_NS = _validate_for_target
+    _validate_for_PTR = _validate_for_target
+
+    def _validate_for_CAA(self, data):
+        match = self._validate_caa_re.match(data)
+        if not match:
+            return ['expected `<flags> <tag> "<value>"`']
+        return self._validate_ranges(match.groups(), [('flags', 0, 255)])
+
+    def _validate_for_LOC(self, data):
+        match = self._validate_loc_re.match(data)
+        if not match:
+            return ['expected `<lat d> <m> <s> <N|S> <long d> <m> <s> <E|W> '
+                    '<alt>m <size>m <hp>m <vp>m`']
+        lat_d, lat_m, lat_s, _, long_d, long_m, long_s, _, altitude, size, \
+            precision_horz, precision_vert = match.groups()
+        return self._validate_ranges([lat_d, lat_m, lat_s, long_d, long_m,
+                                      long_s, altitude, size, precision_horz,
+                                      precision_vert], [
+            ('lat_degrees', 0, 90),
+            ('lat_minutes', 0, 59),
+            ('lat_seconds', 0, 59.999),
+            ('long_degrees', 0, 180),
+            ('long_minutes', 0, 59),
+            ('long_seconds', 0, 59.999),
+            ('altitude', -100000.00, 42849672.95),
+            ('size', 0, 90000000.00),
+            ('precision_horz', 0, 90000000.00),
+            ('precision_vert', 0, 90000000.00),
+        ])
+
+    def _validate_for_MX(self, data):
+        match = self._validate_mx_re.match(data)
+        if not match:
+            return ['expected `<preference> <exchange>`']
+        return self._validate_ranges(match.groups(),
+                                     [('preference', 0, 65535)])
+
+    def _validate_for_NAPTR(self, data):
+        match = self._validate_naptr_re.match(data)
+        if not match:
+            return ['expected `<order> <preference> "<flags>" "<service>" '
+                    '"<regexp>" <replacement>`']
+        return self._validate_ranges(match.groups(), [
+            ('order', 0, 65535),
+            ('preference', 0, 65535),
+        ])
+
+    def _validate_for_SRV(self, data):
+        match = self._validate_srv_re.match(data)
+        if not match:
+            return ['expected `<priority> <weight> <port> <target>`']
+        return self._validate_ranges(match.groups(), [
+            ('priority', 0, 65535),
+            ('weight', 0, 65535),
+            ('port', 0, 65535),
+        ])
+
+    def _validate_for_SSHFP(self, data):
+        match = self._validate_sshfp_re.match(data)
+        if not match:
+            return ['expected `<algorithm> <fingerprint_type> <fingerprint>`']
+        return self._validate_ranges(match.groups(), [
+            ('algorithm', 0, 255),
+            ('fingerprint_type', 0, 255),
+        ])
+
+    def _validate_for_TXT(self, data):
+        if not data:
+            return ['empty value']
+        if data.startswith('"'):
+            for chunk in self._txt_chunk_re.findall(data):
+                if len(chunk) > 255:
+                    return ['character-string longer than 255']
+        return []
+
+    def _validate_record(self, record):
+        name = record.get('name')
+        _type = record.get('type')
+        ttl = record.get('ttl')
+        prefix = f'{name} {_type}'
+
+        reasons = []
+        if not isinstance(name, str) or not self._validate_target_re \
+           .match(name):
+            reasons.append(f'{prefix}: invalid name')
+        if not isinstance(ttl, int) or not 0 <= ttl <= 2147483647:
+            reasons.append(f'{prefix}: invalid ttl "{ttl}"')
+
+        validate = getattr(self, f'_validate_for_{_type}', None)
+        if validate is None:
+            reasons.append(f'{prefix}: unsupported type')
+            return reasons
+
+        # the main data and every value carried by the dynamic configs
+        datas = [record.get('data')]
+        if 'geo_ip_config' in record:
+            config = record['geo_ip_config']
+            datas.extend(m['data'] for m in config['matches'])
+            if config.get('default'):
+                datas.append(config['default'])
+        if 'weighted_config' in record:
+            datas.extend(ips['ip'] for ips in
+                         record['weighted_config']['weighted_ips'])
+        if 'http_service_config' in record:
+            datas.extend(record['http_service_config']['ips'])
+
+        for data in datas:
+            if not isinstance(data, str):
+                reasons.append(f'{prefix}: missing data')
+                continue
+            for reason in validate(data):
+                reasons.append(f'{prefix}: {reason} in "{data}"')
+
+        return reasons
+
+    def _validate_changes(self, changes):
+        reasons = []
+        for change in changes:
+            for params in change.values():
+                id_fields = params.get('idFields')
+                if id_fields is not None and \
+                   (id_fields.get('name') is None or
+                        not id_fields.get('type')):
+                    reasons.append(f'invalid idFields {id_fields}')
+                for record in params.get('records', []):
+                    reasons.extend(self._validate_record(record))
+        return reasons
+
     def _apply_updates(self, zone, updates):
         self._client.record_updates(zone, {
             'return_all_records': False,
@@ -686,15 +2489,249 @@ class ScalewayProvider(BaseProvider):
             'changes': updates
         })
 
+    def _apply_bisect(self, zone, groups):
+        '''
+        Applies the groups of changes, splitting them in halves each time the
+        API rejects them so that the valid ones still land, the changes of a
+        group staying together. Returns the rejected changes.
+        '''
+        updates = [change for group in groups for change in group]
+        try:
+            self._apply_updates(zone, updates)
+            return []
+        except ScalewayClientBadRequest:
+            if len(groups) == 1:
+                self.log.warning('_apply_bisect: rejected changes %s',
+                                 updates)
+                return updates
+            middle = len(groups) // 2
+            self.log.info('_apply_bisect: %d changes rejected, splitting',
+                          len(updates))
+            return self._apply_bisect(zone, groups[:middle]) + \
+                self._apply_bisect(zone, groups[middle:])
+
+    def _chunks(self, groups):
+        '''
+        Packs the groups of changes in chunks of CHUNK_SIZE changes at most,
+        but for larger groups which are never split
+        '''
+        chunks = []
+        size = 0
+        for group in groups:
+            if not chunks or size + len(group) > self.CHUNK_SIZE:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(group)
+            size += len(group)
+        return chunks
+
+    def _rrset_hash(self, records):
+        '''
+        Returns a hash of the records ignoring what the API adds to them (id,
+        comment...) and the different ways to write the same data
+        '''
+        canonical = []
+        for record in records:
+            c = {
+                'name': '' if record['name'] == '@' else record['name'],
+                'type': record['type'],
+                'ttl': record['ttl'],
+                'data': record['data']
+            }
+            if c['type'] == 'TXT':
+                c['data'] = self._txt_value(c['data'])
+            if record.get('geo_ip_config'):
+                config = record['geo_ip_config']
+                c['geo_ip_config'] = {
+                    'matches': [{
+                        'continents': m.get('continents', []),
+                        'countries': m.get('countries', []),
+                        'data': m['data']
+                    } for m in config['matches']],
+                    'default': config.get('default') or None
+                }
+            for key in ('weighted_config', 'http_service_config'):
+                if record.get(key):
+                    c[key] = {k: v for k, v in record[key].items()
+                              if v is not None}
+            canonical.append(json.dumps(c, sort_keys=True))
+        canonical.sort()
+        return sha256('\n'.join(canonical).encode()).hexdigest()
+
+    def _params_delta(self, params, rrset):
+        '''
+        Returns the per-value delete and add changes turning the records of
+        rrset into the ones of the set change, None when the set is smaller
+        or they can't express it
+        '''
+        records = params['set']['records']
+        for record in rrset + records:
+            if 'geo_ip_config' in record or 'weighted_config' in record or \
+               'http_service_config' in record:
+                return None
+        if len(set(r['ttl'] for r in rrset + records)) != 1:
+            return None
+
+        def value(record):
+            if record['type'] == 'TXT':
+                return self._txt_value(record['data'])
+            return record['data']
+
+        old = {value(r): r for r in rrset}
+        new = {value(r): r for r in records}
+        delta = [{
+            'delete': {
+                'idFields': dict(params['set']['idFields'], data=r['data'])
+            }
+        } for v, r in old.items() if v not in new]
+        added = [r for v, r in new.items() if v not in old]
+        if added:
+            delta.append({'add': {'records': added}})
+
+        if len(_dumps(delta)) >= len(_dumps([params])):
+            return None
+        self.log.debug('_apply: %d values deleted and %d added in %s %s',
+                       len(delta) - bool(added), len(added),
+                       params['set']['idFields']['name'],
+                       params['set']['idFields']['type'])
+        return delta
+
+    def _bind_zone_file(self, zone, records):
+        lines = [f'$ORIGIN {zone}.']
+        for record in records:
+            lines.append(f'{self._record_name(record["name"])} '
+                         f'{record["ttl"]} IN {record["type"]} '
+                         f'{record["data"]}')
+        return '\n'.join(lines) + '\n'
+
+    def _bulk_import(self, zone, creates):
+        '''
+        Imports the creates into an empty zone as a BIND zone file, returning
+        those that still have to be PATCHed, the ones a zone file can't hold.
+        Returns None when the zone can't be bulk imported.
+        '''
+        try:
+            existing = self._client.zone_records(zone)
+        except ScalewayClientNotFound:
+            existing = []
+        # the import replaces the whole zone, only zones holding nothing but
+        # the name servers added by their creation are bulk imported
+        if any(r['name'] not in ('', '@') or r['type'] != 'NS'
+               for r in existing):
+            self.log.info('_bulk_import: zone %s isn\'t empty', zone)
+            return None
+
+        imported = []
+        rest = []
+        for params in creates:
+            records = params['add']['records']
+            if records[0]['type'] == 'ALIAS' or \
+               any('geo_ip_config' in r or 'weighted_config' in r or
+                   'http_service_config' in r for r in records):
+                rest.append(params)
+            else:
+                imported.extend(records)
+
+        try:
+            self._client.import_bind_zone(zone, self._bind_zone_file(
+                zone, existing + imported))
+        except ScalewayClientException as e:
+            self.log.warning('_bulk_import: import of %s failed (%s)', zone,
+                             e.__class__.__name__)
+            return None
+        self.log.info('_bulk_import: %d records imported into %s',
+                      len(imported), zone)
+        return rest
+
+    def _change_id(self, change):
+        return sha256(_dumps(change)).hexdigest()
+
+    def _desired_hash(self, desired):
+        '''
+        Returns the hash of the records of the zone as they're sent to the
+        API, the same for every plan towards them
+        '''
+        params = sorted(_dumps(self._params(r)) for r in desired.records)
+        return sha256(b'\n'.join(params)).hexdigest()
+
+    def _resumed_groups(self, zone, groups, journal):
+        '''
+        Returns the groups of changes which an interrupted apply left to
+        send: those neither journaled as done nor found on the server
+        '''
+        rrsets = None
+        ret = []
+        for group in groups:
+            ids = [self._change_id(c) for c in group]
+            if journal.done.issuperset(ids):
+                self.log.info('_apply: skipping %d changes journaled as '
+                              'applied', len(group))
+                continue
+            if rrsets is None:
+                rrsets = defaultdict(list)
+                for record in self._client.zone_records(zone):
+                    rrsets[(record['name'], record['type'])].append(record)
+            if self._chunk_applied(group, rrsets):
+                self.log.info('_apply: skipping %d changes found on the '
+                              'server', len(group))
+                journal.mark(ids, 'done')
+                continue
+            ret.append(group)
+        return ret
+
+    def _chunk_applied(self, chunk, rrsets):
+        '''
+        Returns whether the server records, grouped by (name, type), already
+        hold the result of every change of the chunk
+        '''
+        def rrset(name, _type):
+            return rrsets.get(('' if name == '@' else name, _type), [])
+
+        def values(records):
+            return set(self._rrset_hash([r]) for r in records)
+
+        for change in chunk:
+            if 'add' in change:
+                records = change['add']['records']
+                existing = rrset(records[0]['name'], records[0]['type'])
+                if not values(records) <= values(existing):
+                    return False
+            elif 'set' in change:
+                id_fields = change['set']['idFields']
+                if self._rrset_hash(change['set']['records']) != \
+                   self._rrset_hash(rrset(id_fields['name'],
+                                          id_fields['type'])):
+                    return False
+            else:
+                id_fields = change['delete']['idFields']
+                existing = rrset(id_fields['name'], id_fields['type'])
+                if 'data' in id_fields:
+                    # a single value of the set
+                    existing = [r for r in existing
+                                if values([r]) ==
+                                values([dict(r, data=id_fields['data'])])]
+                if existing:
+                    return False
+        return True
+
     def _apply(self, plan):
         desired = plan.desired
         changes = plan.changes
         zone = desired.name[:-1]
         self.log.debug('_apply: zone=%s, len(changes)=%d', desired.name,
                        len(changes))
+        self._check_deadline(desired.name)
+
+        # The records of the zone as last read from the API, if any
+        with self._zone_records_lock:
+            server = self._zone_records.get(desired.name)
+        rrsets = defaultdict(list)
+        for record in server or []:
+            rrsets[(record['name'], record['type'])].append(record)
 
         # Generate the changes to apply all the Delete, Update and Create
-        # in a single call
+        # in a single call, the updates and deletes as groups of changes
+        # which have to land together
         creates = []
         updates = []
         deletes = []
@@ -702,26 +2739,234 @@ class ScalewayProvider(BaseProvider):
             class_name = change.__class__.__name__.lower()
             if class_name == 'create':
                 creates.append(self._params_create(change))
+            elif self._shared_type(change.record._type):
+                # neither set nor deleted as a whole, the other values of
+                # the set being left alone
+                params = self._params_values(change.existing, change.new)
+                if not params:
+                    self.log.info('_apply: skipping no-op update of %s',
+                                  change.existing.fqdn)
+                    continue
+                updates.append(params)
             elif class_name == 'update':
-                updates.append(self._params_update(change))
+                params = self._params_update(change)
+                rrset = rrsets.get((change.existing.name,
+                                    params['set']['idFields']['type']))
+                # octoDNS may see differences that don't make any on the
+                # API side
+                if rrset and self._rrset_hash(rrset) == \
+                   self._rrset_hash(params['set']['records']):
+                    self.log.info('_apply: skipping no-op update of %s',
+                                  change.existing.fqdn)
+                    continue
+                delta = self._params_delta(params, rrset) if rrset else None
+                if delta is not None:
+                    updates.append(delta)
+                else:
+                    updates.append([params])
             else:
-                updates.append(self._params_delete(change))
-
-        # Apply the update in the right order: deletes, updates and creates
+                updates.append([self._params_delete(change)])
+
+        # A delete followed by a create writing back the very same records,
+        # e.g. an SPF record replacing its TXT twin
+        deleted = {(g[0]['delete']['idFields']['name'],
+                    g[0]['delete']['idFields']['type']): g
+                   for g in updates if 'delete' in g[0] and
+                   'data' not in g[0]['delete']['idFields']}
+        for params in list(creates):
+            records = params['add']['records']
+            key = ('' if records[0]['name'] == '@' else records[0]['name'],
+                   records[0]['type'])
+            if key in deleted and key in rrsets and \
+               self._rrset_hash(rrsets[key]) == self._rrset_hash(records):
+                self.log.info('_apply: skipping no-op replacement of %s %s',
+                              *key)
+                creates.remove(params)
+                updates.remove(deleted[key])
+
+        # Check every change locally so that an invalid plan is reported as a
+        # whole before anything is sent
+        reasons = self._validate_changes(
+            deletes + [c for group in updates for c in group] + creates)
+        if reasons:
+            raise ScalewayProviderValidationError(reasons)
+
+        if not deletes + updates + creates:
+            self.log.info('_apply: nothing to apply')
+            self._zone_applied(desired.name)
+            return
+
+        # Apply the update in the right order: deletes, updates and creates,
+        # but for the creates of a name deleted, e.g. an A record replacing a
+        # CNAME, grouped with their delete so that the name doesn't go
+        # missing when only one of them lands
+        groups = list(updates)
+        replaced = {g[0]['delete']['idFields']['name']: g for g in updates
+                    if 'delete' in g[0] and
+                    'data' not in g[0]['delete']['idFields']}
+        for params in creates:
+            name = params['add']['records'][0]['name']
+            group = replaced.get('' if name == '@' else name)
+            if group is not None:
+                group.append(params)
+            else:
+                groups.append([params])
+        chunked = False
+        journal = None
+        if self.journal_path is not None:
+            # chunked so that an interrupted apply can resume
+            chunked = True
+            os.makedirs(self.journal_path, exist_ok=True)
+            journal = _ApplyJournal(
+                os.path.join(self.journal_path, f'{zone}.journal'),
+                self._desired_hash(desired))
+            if journal.resumed:
+                self.log.info('_apply: resuming the interrupted apply of %s',
+                              desired.name)
+
+        rejected = []
         try:
-            self._apply_updates(zone, deletes + updates + creates)
+            # Bootstrapping a zone with a large set of records is done with
+            # a single import, or chunked PATCHes if the import isn't
+            # possible. A resumed apply goes through the chunks, checked
+            # against the server, whether the import happened or not.
+            if self.bulk_import_threshold is not None and \
+               not deletes + updates and \
+               sum(len(p['add']['records']) for p in creates) >= \
+               self.bulk_import_threshold:
+                chunked = True
+                rest = None
+                if journal is None or not journal.resumed:
+                    rest = self._bulk_import(zone, creates)
+                if rest is not None:
+                    groups = [[params] for params in rest]
+            if journal is not None and journal.resumed:
+                # the changes sent, or after them, may have landed
+                groups = self._resumed_groups(zone, groups, journal)
+            chunks = [groups]
+            if chunked:
+                chunks = self._chunks(groups)
+
+            for groups in chunks:
+                chunk = [change for group in groups for change in group]
+                if journal is not None:
+                    ids = [self._change_id(c) for c in chunk]
+                    journal.mark(ids, 'started')
+                if self.bisect_on_bad_request:
+                    rejected.extend(self._apply_bisect(zone, groups))
+                else:
+                    self._apply_updates(zone, chunk)
+                if journal is not None:
+                    journal.mark(ids, 'done')
+        except ScalewayClientDeadlineExceeded as e:
+            # the chunks applied are journaled, if enabled, and the one in
+            # flight landed or not as a whole
+            raise self._deadline_exceeded(desired.name) from e
         except ScalewayClientForbidden:
             e = ScalewayClientUnknownDomainName()
             e.__cause__ = None
             raise e
-
-        # Clear out the cache if any
-        self._zone_records.pop(desired.name, None)
+        finally:
+            # Clear out the cache if any, even after a partial apply, along
+            # with what the fetches in flight would put back
+            with self._zone_records_lock:
+                self._zone_generations[desired.name] += 1
+                self._zone_records.pop(desired.name, None)
+                self._zone_records_fetched.pop(desired.name, None)
+                self._zone_records_fetches.pop(desired.name, None)
+            if journal is not None:
+                journal.close()
+
+        if journal is not None:
+            journal.complete()
+        self._zone_applied(desired.name)
+
+        if rejected:
+            raise ScalewayProviderRejectedChanges(rejected)
+
+    def _canonical_record(self, record):
+        '''
+        Returns the record as it will be read back once written
+        '''
+        params = [dict(p, name=record.name) for p in self._params(record)]
+        data = getattr(self, f'_data_for_{record._type}')(record._type,
+                                                          params)
+        data['octodns'] = dict(record._octodns, **data.get('octodns', {}))
+        return Record.new(record.zone, record.name, data,
+                          source=record.source, lenient=True)
 
     def _process_desired_zone(self, desired):
         for record in desired.records:
+            if not self._managed_name(record.name):
+                self.log.debug('_process_desired_zone: ignoring %s, name not '
+                               'managed', record.fqdn)
+                desired.remove_record(record)
+                continue
+            if not self._managed_type(record._type):
+                self.log.debug('_process_desired_zone: ignoring %s %s, type '
+                               'not managed', record.fqdn, record._type)
+                desired.remove_record(record)
+                continue
+
             # test records
             if getattr(record, 'dynamic', False):
                 self._params_dynamic(record)
 
+                # plan for what will actually be stored so that a stable
+                # zone doesn't churn
+                canonical = self._canonical_record(record)
+                if canonical.dynamic != record.dynamic or \
+                   canonical.values != record.values:
+                    msg = f'dynamic {record._type} record {record.fqdn} ' \
+                        'can\'t be stored as configured'
+                    fallback = f'using {canonical.values}, ' \
+                        f'{canonical.dynamic}'
+                    self.supports_warn_or_except(msg, fallback)
+                    desired.add_record(canonical, replace=True)
+
         return super(ScalewayProvider, self)._process_desired_zone(desired)
+
+
+class ScalewaySnapshotSource(ScalewayProvider):
+    '''
+    Source replaying the records of a snapshot written by
+    ScalewayClient.export_snapshot, without any network access.
+    '''
+
+    def __init__(self, id, path, *args, **kwargs):
+        super(ScalewaySnapshotSource, self).__init__(id, None, False, *args,
+                                                     **kwargs)
+        self.log = getLogger(f'ScalewaySnapshotSource[{id}]')
+        self.log.debug('__init__: id=%s, path=%s', id, path)
+        self._client.close()
+        self._client = _SnapshotClient(path, id)
+
+    def _apply(self, plan):
+        raise ScalewayProviderException(f'{self.id}: snapshots are read only')
+
+
+def snapshot_main(argv=None):
+    '''
+    Exports the records of Scaleway DNS zones to a snapshot file
+    '''
+    parser = ArgumentParser(description=snapshot_main.__doc__.strip())
+    parser.add_argument('--token-env', default='SCALEWAY_SECRET_KEY',
+                        help='environment variable holding the API secret '
+                        'key')
+    parser.add_argument('--output', required=True,
+                        help='path of the snapshot written')
+    parser.add_argument('zones', nargs='+', help='names of the zones')
+    args = parser.parse_args(argv)
+
+    token = os.environ.get(args.token_env)
+    if not token:
+        parser.error(f'the environment variable {args.token_env} holding '
+                     'the API secret key isn\'t set')
+    client = ScalewayClient(token, 'snapshot', False)
+    try:
+        exported = client.export_snapshot(args.zones, args.output)
+    finally:
+        client.close()
+    missing = sorted(set(args.zones) - set(exported))
+    if missing:
+        parser.exit(1, f'zones not found: {", ".join(missing)}\n')
@@ -21,6 +21,14 @@ setup(
     author='Jeremy JACQUEMIN',
     author_email='domain-team@scaleway.com',
     description=description,
+    entry_points={
+        'console_scripts': (
+            'octodns-scaleway-snapshot = octodns_scaleway:snapshot_main',
+        ),
+    },
+    extras_require={
+        'http2': ('httpx[http2]>=0.23.0',),
+    },
     license='MIT',
     long_description=long_description,
     long_description_content_type='text/markdown',
@@ -34,6 +42,7 @@ setup(
     url='https://github.com/scaleway/octodns-scaleway',
     version=version(),
     tests_require=(
+        'httpx[http2]',
         'mock>=4.0.3',
         'pytest',
         'pytest-network',
@@ -2,18 +2,94 @@
 #
 #
 
-from requests import HTTPError
+from concurrent.futures import Future, ProcessPoolExecutor, \
+    ThreadPoolExecutor
+from copy import deepcopy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from gzip import compress, open as gzip_open
+from os.path import exists, join
+from random import Random
+from io import BytesIO, StringIO
+from requests import ConnectionError, HTTPError, Response, Timeout
 from requests_mock import ANY, mock as requests_mock
+from tempfile import TemporaryDirectory
+from threading import Event, Lock, Thread
+from time import monotonic, perf_counter, sleep
 from unittest import TestCase
-from unittest.mock import Mock, call
+from unittest.mock import Mock, call, patch
+from urllib3.util.request import ACCEPT_ENCODING
+import httpx
+import json
+import pytest
 
-from octodns.record import Record
-from octodns_scaleway import ScalewayClientBadRequest,\
-    ScalewayClientUnknownDomainName, ScalewayClientNotFound, ScalewayProvider,\
-    ScalewayProviderException
+from octodns.provider import SupportsException
+from octodns.provider.plan import Plan
+from octodns.record import Create, Record, Update, ValidationError
+from octodns_scaleway import ScalewayClient, ScalewayClientBadRequest,\
+    ScalewayClientCircuitOpen, ScalewayClientDeadlineExceeded, \
+    ScalewayClientException, ScalewayClientForbidden, \
+    ScalewayClientUnknownDomainName, ScalewayClientNotFound, \
+    ScalewayProvider, ScalewayProviderDeadlineExceeded, \
+    ScalewayProviderException, ScalewayProviderRejectedChanges, \
+    ScalewayProviderValidationError, ScalewaySnapshotSource, _AimdLimiter, \
+    _Hedger, _JsonStream, _SharedTokenBucket, \
+    _Http2Transport, _dumps, _json_backend, _records_for_groups, _schedule, \
+    snapshot_main
 from octodns.zone import Zone
 
 
+def _gzip_text(path):
+    with gzip_open(path, 'rt') as fh:
+        return fh.read()
+
+
+def _drain_bucket(path, count):
+    bucket = _SharedTokenBucket(path, 'shared', 100, 5)
+    for _ in range(count):
+        sleep(bucket.reserve())
+
+
+class _ThrottlingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            throttled = server.in_flight > server.capacity
+        if throttled:
+            self.send_response(429)
+            body = b''
+        else:
+            sleep(0.02)
+            self.send_response(200)
+            body = b'{"records": [{"name": "www", "type": "A", ' \
+                b'"data": "1.2.3.4", "ttl": 300}, {"name": "www", ' \
+                b'"type": "A", "data": "1.2.3.5", "ttl": 300}]}'
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with server.lock:
+            server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+class _ThrottlingServer(ThreadingHTTPServer):
+    '''
+    Local stand-in for the API, throttling beyond capacity requests at a
+    time
+    '''
+    daemon_threads = True
+
+    def __init__(self, capacity):
+        super().__init__(('127.0.0.1', 0), _ThrottlingHandler)
+        self.capacity = capacity
+        self.in_flight = 0
+        self.lock = Lock()
+
+
 class TestScalewayProvider(TestCase):
     expected = Zone('unit.tests.', [])
     for name, data in (
@@ -503,11 +579,11 @@ class TestScalewayProvider(TestCase):
 
         provider = ScalewayProvider('test', 'token', False)
         resp = Mock()
-        resp.json = Mock()
+        provider._client._json = Mock()
         provider._client._request = Mock(return_value=resp)
 
         # non-existent domain, create everything
-        resp.json.side_effect = [
+        provider._client._json.side_effect = [
             ScalewayClientNotFound,  # no zone in populate
             ScalewayClientNotFound,  # no domain during apply
         ]
@@ -520,7 +596,10 @@ class TestScalewayProvider(TestCase):
 
         provider._client._request.assert_has_calls([
             # created some of the record with expected data
-            call('GET', '/dns-zones/unit.tests/records?page_size=1000'),
+            call('GET', '/dns-zones/unit.tests/records', params={
+                'page': 1,
+                'page_size': 1000
+            }, stream=False),
             call('PATCH', '/dns-zones/unit.tests/records', data={
                 'return_all_records': False,
                 'disallow_new_zone_creation': True,
@@ -731,8 +810,8 @@ class TestScalewayProvider(TestCase):
                                     'name': 'sub',
                                     'ttl': 1800,
                                     'type': 'TXT',
-                                    'data': 'v=spf1 ip4:127.0.0.1/24 '\
-                                    'ip4:192.168.1.1 a -all'
+                                    'data': '"v=spf1 ip4:127.0.0.1/24 '\
+                                    'ip4:192.168.1.1 a -all"'
                                 }
                             ]
                         }
@@ -780,7 +859,7 @@ class TestScalewayProvider(TestCase):
             }
         ])
         # Domain exists, we don't care about return
-        resp.json.side_effect = ['{}']
+        provider._client._json.side_effect = ['{}']
 
         wanted = Zone('unit.tests.', [])
         wanted.add_record(Record.new(wanted, 'ttl', {
@@ -826,3 +905,2676 @@ class TestScalewayProvider(TestCase):
                 ]
             })
         ], any_order=True)
+
+    def test_validate_changes(self):
+        provider = ScalewayProvider('test', 'token')
+
+        def record(_type, data, **kwargs):
+            return dict({
+                'name': 'www',
+                'ttl': 300,
+                'type': _type,
+                'data': data
+            }, **kwargs)
+
+        valid = [
+            record('A', '1.2.3.4', geo_ip_config={
+                'matches': [{'data': '2.2.2.2'}],
+                'default': '3.3.3.3'
+            }),
+            record('A', '1.2.3.4', weighted_config={
+                'weighted_ips': [{'ip': '2.2.2.2', 'weight': 1}]
+            }),
+            record('A', '1.2.3.4', http_service_config={
+                'ips': ['2.2.2.2']
+            }),
+            record('AAAA', '2001:db8::1'),
+            record('CAA', '0 issue "ca.unit.tests"'),
+            record('CNAME', 'target.unit.tests.'),
+            record('LOC', '51 57 0.123 N 5 54 0.000 E 4.00m 1.00m '
+                   '10000.00m 10.00m'),
+            record('MX', '10 smtp.unit.tests.'),
+            record('NAPTR', '10 20 "U" "SIP+D2U" "!^.*$!sip:info@x!" .'),
+            record('SRV', '10 20 30 target.unit.tests.'),
+            record('SSHFP', '1 1 bf6b6825d2977c511a475bbefb88aad54a92ac73'),
+            record('TXT', 'v=spf1 -all'),
+        ]
+        self.assertEqual([], provider._validate_changes([
+            {'add': {'records': valid}},
+            {'set': {'idFields': {'name': '', 'type': 'A'},
+                     'records': valid[:1]}},
+            {'delete': {'idFields': {'name': 'www', 'type': 'A'}}},
+        ]))
+
+        invalid = [
+            record('A', '1.2.3', ttl=-1),
+            record('A', '1.2.3.4', name='w w', geo_ip_config={
+                'matches': [{'data': 'nope'}],
+                'default': ''
+            }),
+            record('A', None),
+            record('AAAA', '1.2.3.4'),
+            record('CAA', '0 issue ca.unit.tests'),
+            record('CAA', '256 issue "ca.unit.tests"'),
+            record('CNAME', 'not a target'),
+            record('LOC', '51 57 0.123 N'),
+            record('LOC', '91 57 0.123 N 5 54 0.000 E 4.00m 1.00m '
+                   '10000.00m 10.00m'),
+            record('MX', 'smtp.unit.tests.'),
+            record('MX', '65536 smtp.unit.tests.'),
+            record('NAPTR', '10 20 U SIP+D2U !^.*$!sip:info@x! .'),
+            record('NAPTR', '10 65536 "U" "SIP+D2U" "!^.*$!sip:info@x!" .'),
+            record('SRV', '10 20 target.unit.tests.'),
+            record('SRV', '10 20 65536 target.unit.tests.'),
+            record('SSHFP', '1 1 not-hex'),
+            record('SSHFP', '1 256 bf6b6825d2977c511a475bbefb88aad54a92ac73'),
+            record('TXT', ''),
+            record('FNAME', 'foo'),
+        ]
+        reasons = provider._validate_changes([
+            {'add': {'records': invalid}},
+            {'delete': {'idFields': {'type': 'A'}}},
+        ])
+        self.assertEqual([
+            'www A: invalid ttl "-1"',
+            'www A: not a valid IPv4 address in "1.2.3"',
+            'w w A: invalid name',
+            'w w A: not a valid IPv4 address in "nope"',
+            'www A: missing data',
+            'www AAAA: not a valid IPv6 address in "1.2.3.4"',
+            'www CAA: expected `<flags> <tag> "<value>"` in '
+            '"0 issue ca.unit.tests"',
+            'www CAA: flags 256 out of range in '
+            '"256 issue "ca.unit.tests""',
+            'www CNAME: not a valid target in "not a target"',
+            'www LOC: expected `<lat d> <m> <s> <N|S> <long d> <m> <s> '
+            '<E|W> <alt>m <size>m <hp>m <vp>m` in "51 57 0.123 N"',
+            'www LOC: lat_degrees 91 out of range in "91 57 0.123 N 5 54 '
+            '0.000 E 4.00m 1.00m 10000.00m 10.00m"',
+            'www MX: expected `<preference> <exchange>` in '
+            '"smtp.unit.tests."',
+            'www MX: preference 65536 out of range in '
+            '"65536 smtp.unit.tests."',
+            'www NAPTR: expected `<order> <preference> "<flags>" '
+            '"<service>" "<regexp>" <replacement>` in '
+            '"10 20 U SIP+D2U !^.*$!sip:info@x! ."',
+            'www NAPTR: preference 65536 out of range in '
+            '"10 65536 "U" "SIP+D2U" "!^.*$!sip:info@x!" ."',
+            'www SRV: expected `<priority> <weight> <port> <target>` in '
+            '"10 20 target.unit.tests."',
+            'www SRV: port 65536 out of range in '
+            '"10 20 65536 target.unit.tests."',
+            'www SSHFP: expected `<algorithm> <fingerprint_type> '
+            '<fingerprint>` in "1 1 not-hex"',
+            'www SSHFP: fingerprint_type 256 out of range in '
+            '"1 256 bf6b6825d2977c511a475bbefb88aad54a92ac73"',
+            'www TXT: empty value in ""',
+            'www FNAME: unsupported type',
+            'invalid idFields {\'type\': \'A\'}',
+        ], reasons)
+
+        # invalid plans are rejected as a whole before any request
+        provider._client._request = Mock()
+        provider._client.zone_records = Mock(return_value=[])
+        wanted = Zone('unit.tests.', [])
+        wanted.add_record(Record.new(wanted, 'mx', {
+            'ttl': 300,
+            'type': 'MX',
+            'value': {
+                'preference': 10,
+                'exchange': 'smtp.unit.tests.'
+            }
+        }))
+        plan = provider.plan(wanted)
+        plan.changes[0].new.values[0].exchange = 'smtp unit.tests.'
+        with self.assertRaises(ScalewayProviderValidationError) as ctx:
+            provider.apply(plan)
+        self.assertEqual(['mx MX: expected `<preference> <exchange>` in '
+                          '"10 smtp unit.tests."'], ctx.exception.reasons)
+        self.assertEqual('Invalid changes:\n  - mx MX: expected '
+                         '`<preference> <exchange>` in "10 smtp unit.tests."',
+                         str(ctx.exception))
+        provider._client._request.assert_not_called()
+
+    def test_apply_bisect(self):
+        provider = ScalewayProvider('test', 'token',
+                                    bisect_on_bad_request=True)
+        provider._client.zone_records = Mock(return_value=[{
+            'name': 'old',
+            'data': '1.2.3.4',
+            'ttl': 300,
+            'type': 'A',
+        }])
+
+        wanted = Zone('unit.tests.', [])
+        for n in range(7):
+            wanted.add_record(Record.new(wanted, f'www{n}', {
+                'ttl': 300,
+                'type': 'A',
+                'value': f'1.2.3.{n}'
+            }))
+
+        # the API refuses any batch holding www2 or the deletion of old
+        def record_updates(zone, data):
+            for change in data['changes']:
+                if 'delete' in change or \
+                   change['add']['records'][0]['name'] == 'www2':
+                    raise ScalewayClientBadRequest()
+            applied.extend(data['changes'])
+
+        applied = []
+        provider._client.record_updates = Mock(side_effect=record_updates)
+
+        plan = provider.plan(wanted)
+        self.assertEqual(8, len(plan.changes))
+        with self.assertRaises(ScalewayProviderRejectedChanges) as ctx:
+            provider.apply(plan)
+        self.assertEqual([
+            {'type': 'A', 'name': 'old'},
+            {'type': 'A', 'name': 'www2'},
+        ], ctx.exception.id_fields)
+        self.assertEqual('Rejected changes:\n'
+                         "  - {'type': 'A', 'name': 'old'}\n"
+                         "  - {'type': 'A', 'name': 'www2'}",
+                         str(ctx.exception))
+        self.assertEqual(['www0', 'www1', 'www3', 'www4', 'www5', 'www6'],
+                         [c['add']['records'][0]['name'] for c in applied])
+        # 1 + 2 + 4 + 2 requests instead of one per change
+        self.assertEqual(9, provider._client.record_updates.call_count)
+        self.assertFalse(provider._zone_records)
+
+        # without the option a bad request fails the whole apply
+        provider.bisect_on_bad_request = False
+        provider._client.record_updates.reset_mock()
+        with self.assertRaises(ScalewayClientBadRequest):
+            provider.apply(plan)
+        self.assertEqual(1, provider._client.record_updates.call_count)
+
+        # a name changing type is deleted and created together, the record
+        # never going missing when the create is rejected
+        provider.bisect_on_bad_request = True
+        provider._client.zone_records = Mock(return_value=[{
+            'name': 'www',
+            'data': 'unit.tests.',
+            'ttl': 300,
+            'type': 'CNAME',
+        }, {
+            'name': 'old',
+            'data': '1.2.3.4',
+            'ttl': 300,
+            'type': 'A',
+        }])
+
+        def record_updates(zone, data):
+            for change in data['changes']:
+                if 'add' in change and \
+                   change['add']['records'][0]['data'] == '6.6.6.6':
+                    raise ScalewayClientBadRequest()
+            applied.extend(data['changes'])
+
+        provider._client.record_updates = Mock(side_effect=record_updates)
+        wanted = Zone('unit.tests.', [])
+        for name in ('www', 'other'):
+            wanted.add_record(Record.new(wanted, name, {
+                'ttl': 300,
+                'type': 'A',
+                'value': '6.6.6.6' if name == 'www' else '1.2.3.5'
+            }))
+        plan = provider.plan(wanted)
+        applied.clear()
+        with self.assertRaises(ScalewayProviderRejectedChanges) as ctx:
+            provider.apply(plan)
+        self.assertEqual([
+            {'type': 'CNAME', 'name': 'www'},
+            {'type': 'A', 'name': 'www'},
+        ], ctx.exception.id_fields)
+        self.assertEqual([
+            {'delete': {'idFields': {'type': 'A', 'name': 'old'}}},
+            {'add': {'records': [{'name': 'other', 'type': 'A',
+                                  'data': '1.2.3.5', 'ttl': 300}]}},
+        ], applied)
+
+    def test_chunks(self):
+        provider = ScalewayProvider('test', 'token')
+        provider.CHUNK_SIZE = 3
+        self.assertEqual([
+            [['a'], ['b', 'c']],
+            [['d', 'e', 'f', 'g']],
+            [['h'], ['i']],
+        ], provider._chunks([['a'], ['b', 'c'], ['d', 'e', 'f', 'g'], ['h'],
+                             ['i']]))
+        self.assertEqual([], provider._chunks([]))
+
+    def test_zone_records_single_flight(self):
+        provider = ScalewayProvider('test', 'token')
+        zone = Zone('unit.tests.', [])
+        release = Event()
+        records = [{
+            'name': 'www',
+            'data': '1.2.3.4',
+            'ttl': 300,
+            'type': 'A',
+        }]
+
+        def zone_records(zone_name):
+            release.wait(5)
+            return records
+
+        provider._client.zone_records = Mock(side_effect=zone_records)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [executor.submit(provider.zone_records, zone)
+                       for _ in range(8)]
+            # let every caller join the fetch in flight
+            sleep(0.1)
+            release.set()
+            results = [f.result() for f in futures]
+
+        provider._client.zone_records.assert_called_once_with('unit.tests')
+        for result in results:
+            self.assertEqual(records, result)
+            self.assertIs(results[0], result)
+        self.assertEqual({zone.name: records}, provider._zone_records)
+        self.assertEqual({}, provider._zone_records_fetches)
+
+        # failures are shared by the callers waiting on the fetch
+        release.clear()
+
+        def zone_records(zone_name):
+            release.wait(5)
+            raise ScalewayClientBadRequest()
+
+        provider._client.zone_records = Mock(side_effect=zone_records)
+        other = Zone('other.tests.', [])
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(provider.zone_records, other)
+                       for _ in range(4)]
+            sleep(0.1)
+            release.set()
+            for future in futures:
+                with self.assertRaises(ScalewayClientBadRequest):
+                    future.result()
+
+        provider._client.zone_records.assert_called_once_with('other.tests')
+        self.assertNotIn(other.name, provider._zone_records)
+        self.assertEqual({}, provider._zone_records_fetches)
+
+        # the fetches in flight during an apply aren't cached, they may have
+        # read the records from before the changes
+        desired = Zone('unit.tests.', [])
+        record = Record.new(desired, 'new', {
+            'ttl': 300,
+            'type': 'A',
+            'value': '1.2.3.5'
+        })
+        desired.add_record(record)
+        plan = Plan(Zone('unit.tests.', []), desired, [Create(record)], True)
+        provider._client.record_updates = Mock()
+        fresh = records + [{
+            'name': 'new',
+            'data': '1.2.3.5',
+            'ttl': 300,
+            'type': 'A',
+        }]
+        calls = []
+
+        def zone_records(zone_name):
+            calls.append(zone_name)
+            ret = records if len(calls) == 1 else fresh
+            release.wait(5)
+            return ret
+
+        provider._client.zone_records = Mock(side_effect=zone_records)
+        provider._zone_records = {}
+        release.clear()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            before = executor.submit(provider.zone_records, zone)
+            sleep(0.1)
+            provider.apply(plan)
+            # a new fetch is started instead of joining the stale one
+            after = executor.submit(provider.zone_records, zone)
+            sleep(0.1)
+            release.set()
+            self.assertEqual(records, before.result())
+            self.assertEqual(fresh, after.result())
+        self.assertEqual(2, len(calls))
+        self.assertEqual({zone.name: fresh}, provider._zone_records)
+        self.assertEqual({}, provider._zone_records_fetches)
+
+        # nor do they drop what was cached since
+        def zone_records(zone_name):
+            release.wait(5)
+            raise ScalewayClientNotFound()
+
+        provider._client.zone_records = Mock(side_effect=zone_records)
+        release.clear()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            before = executor.submit(provider._fetch, zone.name)
+            sleep(0.1)
+            provider.apply(plan)
+            with provider._zone_records_lock:
+                provider._zone_records[zone.name] = fresh
+            release.set()
+            self.assertEqual([], before.result())
+        self.assertEqual({zone.name: fresh}, provider._zone_records)
+
+    def test_txt_round_trip(self):
+        provider = ScalewayProvider('test', 'token')
+        long_value = 'v=DKIM1\\; k=rsa\\; p=' + 'A' * 600
+
+        # values as written by octoDNS and read back from the API
+        for values in (
+            ['v=spf1 -all'],
+            ['v=spf1 include:_spf.unit.tests ~all', 'google-site=abc'],
+            ['v=DMARC1\\; p=reject\\; rua=mailto:dmarc@unit.tests'],
+            ['with "quotes" inside', 'with \\\\ backslash'],
+            [long_value, 'unicodé'],
+        ):
+            zone = Zone('unit.tests.', [])
+            record = Record.new(zone, 'txt', {
+                'ttl': 300,
+                'type': 'TXT',
+                'values': values
+            })
+            zone.add_record(record)
+            params = provider._params(record.copy())
+            self.assertEqual([], provider._validate_changes([
+                {'add': {'records': params}}
+            ]))
+            # SPF are written as TXT
+            self.assertEqual(params, provider._params(Record.new(
+                zone, 'txt', {
+                    'ttl': 300,
+                    'type': 'SPF',
+                    'values': values
+                })))
+            # the API hands back the data as it has been written
+            provider._zone_records[zone.name] = params
+            self.assertIsNone(provider.plan(zone))
+            del provider._zone_records[zone.name]
+
+        self.assertEqual(3, len(provider._params_for_TXT(Record.new(
+            zone, 'txt', {
+                'ttl': 300,
+                'type': 'TXT',
+                'value': long_value
+            }))[0]['data'].split('" "')))
+
+        # the forms the API may hand back
+        for data, value in (
+            ('v=spf1 -all', 'v=spf1 -all'),
+            ('"v=spf1 -all"', 'v=spf1 -all'),
+            ('"v=DKIM1; k=rsa; " "p=ABC"', 'v=DKIM1\\; k=rsa\\; p=ABC'),
+            ('"v=DKIM1\\; k=rsa"', 'v=DKIM1\\; k=rsa'),
+            ('v=DKIM1\\; k=rsa', 'v=DKIM1\\; k=rsa'),
+            ('"say \\"hi\\""', 'say "hi"'),
+        ):
+            self.assertEqual(value, provider._txt_value(data))
+
+        self.assertEqual(['www TXT: character-string longer than 255 in '
+                          f'""{"a" * 256}""'],
+                         provider._validate_changes([{'add': {'records': [{
+                             'name': 'www',
+                             'ttl': 300,
+                             'type': 'TXT',
+                             'data': f'"{"a" * 256}"'
+                         }]}}]))
+
+    def test_dynamic_round_trip(self):
+        rand = Random(42)
+        geos = ['AF', 'AS', 'EU', 'NA', 'OC', 'SA', 'EU-BE', 'EU-CH',
+                'EU-FR', 'NA-CA', 'NA-US', 'AS-JP']
+
+        def ips(n):
+            return [f'10.{rand.randint(0, 255)}.{rand.randint(0, 255)}.'
+                    f'{rand.randint(0, 255)}' for _ in range(n)]
+
+        def geo():
+            n = rand.randint(1, 4)
+            names = [f'pool-{i}' for i in range(n)]
+            catch_all = n > 1 and rand.random() < 0.5
+            available = rand.sample(geos, len(geos))
+            rules = []
+            for name in rand.sample(names, n):
+                if catch_all and name == names[-1]:
+                    continue
+                rules.append({
+                    'pool': name,
+                    'geos': [available.pop()
+                             for _ in range(rand.randint(1, 2))]
+                })
+            if catch_all:
+                rules.append({'pool': names[-1]})
+            used = set(r['pool'] for r in rules)
+            pools = {}
+            for name in names:
+                if name not in used:
+                    continue
+                pools[name] = {
+                    'values': [{'value': v}
+                               for v in ips(rand.randint(1, 3))]
+                }
+                if name != names[-1] and rand.random() < 0.5:
+                    pools[name]['fallback'] = names[-1]
+            # pool names must stay contiguous
+            renames = {name: f'pool-{i}' for i, name in
+                       enumerate(n for n in names if n in pools)}
+            for rule in rules:
+                rule['pool'] = renames[rule['pool']]
+            pools = {renames[name]: pool for name, pool in pools.items()}
+            for pool in pools.values():
+                if 'fallback' in pool:
+                    if pool['fallback'] in renames:
+                        pool['fallback'] = renames[pool['fallback']]
+                    else:
+                        del pool['fallback']
+            return {'pools': pools, 'rules': rules}, {}
+
+        def weighted():
+            values = [{'value': v, 'weight': rand.randint(1, 10)}
+                      for v in ips(rand.randint(2, 4))]
+            values[0]['weight'] = rand.randint(2, 10)
+            return {
+                'pools': {'pool-0': {'values': values}},
+                'rules': [{'pool': 'pool-0'}]
+            }, {}
+
+        def healthcheck():
+            return {
+                'pools': {'pool-0': {
+                    'values': [{'value': v}
+                               for v in ips(rand.randint(1, 3))]
+                }},
+                'rules': [{'pool': 'pool-0'}]
+            }, {
+                'healthcheck': {
+                    'host': rand.choice(['check.unit.tests', None]),
+                    'path': rand.choice(['/check', '/_dns']),
+                    'port': rand.choice([80, 443, 8080]),
+                    'protocol': rand.choice(['HTTP', 'HTTPS'])
+                }
+            }
+
+        for i in range(300):
+            dynamic, octodns = rand.choice([geo, weighted, healthcheck])()
+            desired = Zone('unit.tests.', [])
+            desired.add_record(Record.new(desired, 'dynamic', {
+                'ttl': 300,
+                'type': 'A',
+                'values': ips(rand.randint(1, 2)),
+                'dynamic': dynamic,
+                'octodns': octodns
+            }))
+
+            # a fake API storing what is written
+            stored = []
+
+            def record_updates(zone, data):
+                for change in data['changes']:
+                    stored.extend(change['add']['records'])
+
+            provider = ScalewayProvider('test', 'token')
+            provider._client.zone_records = Mock(return_value=stored)
+            provider._client.record_updates = Mock(side_effect=record_updates)
+
+            plan = provider.plan(desired)
+            self.assertEqual(1, len(plan.changes))
+            provider.apply(plan)
+            self.assertTrue(stored)
+
+            # populate(apply(x)) == x, nothing left to do
+            self.assertIsNone(provider.plan(desired), desired.records)
+
+        # strict providers refuse what can't be stored as configured
+        provider = ScalewayProvider('test', 'token', strict_supports=True)
+        provider._client.zone_records = Mock(return_value=[])
+        desired = Zone('unit.tests.', [])
+        desired.add_record(Record.new(desired, 'dynamic', {
+            'ttl': 300,
+            'type': 'A',
+            'values': ['1.1.1.1', '2.2.2.2'],
+            'dynamic': {
+                'pools': {'pool-0': {'values': [{'value': '3.3.3.3'}]}},
+                'rules': [{'pool': 'pool-0', 'geos': ['EU']}]
+            }
+        }))
+        with self.assertRaises(SupportsException) as ctx:
+            provider.plan(desired)
+        self.assertEqual('test: dynamic A record dynamic.unit.tests. can\'t '
+                         'be stored as configured', str(ctx.exception))
+
+    def test_apply_skips_no_op(self):
+        provider = ScalewayProvider('test', 'token')
+        provider._client.zone_records = Mock(return_value=[{
+            'id': 'a4f32d5b-1a2f-4c5e-8d6a-1b2c3d4e5f60',
+            'name': 'spf',
+            'data': '"v=spf1 -all"',
+            'priority': 0,
+            'ttl': 300,
+            'type': 'TXT',
+            'comment': None
+        }, {
+            'name': 'www',
+            'data': '1.2.3.4',
+            'ttl': 300,
+            'type': 'A'
+        }, {
+            'name': 'www2',
+            'data': '1.2.3.4',
+            'ttl': 300,
+            'type': 'A'
+        }])
+        provider._client.record_updates = Mock()
+
+        # SPF are written as TXT, replacing the TXT by the SPF is a no-op
+        desired = Zone('unit.tests.', [])
+        desired.add_record(Record.new(desired, 'spf', {
+            'ttl': 300,
+            'type': 'SPF',
+            'value': 'v=spf1 -all'
+        }))
+        for name in ('www', 'www2'):
+            desired.add_record(Record.new(desired, name, {
+                'ttl': 300,
+                'type': 'A',
+                'value': '1.2.3.4'
+            }))
+        plan = provider.plan(desired)
+        self.assertEqual(2, len(plan.changes))
+        provider.apply(plan)
+        provider._client.record_updates.assert_not_called()
+
+        # updates planned from a stale state that the API already holds
+        existing = Zone('unit.tests.', [])
+        provider.populate(existing)
+        stale = Zone('unit.tests.', [])
+        changes = []
+        for name, ttl in (('www', 300), ('www2', 600)):
+            record = Record.new(stale, name, {
+                'ttl': 60,
+                'type': 'A',
+                'value': '1.2.3.4'
+            })
+            stale.add_record(record)
+            new = Record.new(desired, name, {
+                'ttl': ttl,
+                'type': 'A',
+                'value': '1.2.3.4'
+            })
+            changes.append(Update(record, new))
+        provider.apply(Plan(stale, desired, changes, True))
+        provider._client.record_updates.assert_called_once_with(
+            'unit.tests', {
+                'return_all_records': False,
+                'disallow_new_zone_creation': True,
+                'changes': [{
+                    'set': {
+                        'idFields': {
+                            'type': 'A',
+                            'name': 'www2'
+                        },
+                        'records': [{
+                            'name': 'www2',
+                            'ttl': 600,
+                            'type': 'A',
+                            'data': '1.2.3.4'
+                        }]
+                    }
+                }]
+            })
+
+    def test_rrset_hash(self):
+        provider = ScalewayProvider('test', 'token')
+
+        for server, params in (
+            ([{
+                'id': '1',
+                'name': '',
+                'data': '"v=spf1 " "-all"',
+                'ttl': 300,
+                'type': 'TXT'
+            }, {
+                'name': '',
+                'data': 'other',
+                'ttl': 300,
+                'type': 'TXT'
+            }], [{
+                'name': '@',
+                'data': '"other"',
+                'ttl': 300,
+                'type': 'TXT'
+            }, {
+                'name': '@',
+                'data': '"v=spf1 -all"',
+                'ttl': 300,
+                'type': 'TXT'
+            }]),
+            ([{
+                'name': 'geo',
+                'data': '1.1.1.1',
+                'ttl': 300,
+                'type': 'A',
+                'geo_ip_config': {
+                    'matches': [{
+                        'continents': ['EU'],
+                        'countries': [],
+                        'data': '2.2.2.2',
+                        'datas': ['2.2.2.2']
+                    }],
+                    'default': ''
+                }
+            }], [{
+                'name': 'geo',
+                'data': '1.1.1.1',
+                'ttl': 300,
+                'type': 'A',
+                'geo_ip_config': {
+                    'matches': [{
+                        'continents': ['EU'],
+                        'countries': [],
+                        'data': '2.2.2.2'
+                    }]
+                }
+            }]),
+            ([{
+                'name': 'check',
+                'data': '1.1.1.1',
+                'ttl': 300,
+                'type': 'A',
+                'http_service_config': {
+                    'ips': ['2.2.2.2'],
+                    'must_contain': None,
+                    'url': 'HTTPS://check:443/',
+                }
+            }], [{
+                'name': 'check',
+                'data': '1.1.1.1',
+                'ttl': 300,
+                'type': 'A',
+                'http_service_config': {
+                    'ips': ['2.2.2.2'],
+                    'url': 'HTTPS://check:443/',
+                }
+            }]),
+        ):
+            self.assertEqual(provider._rrset_hash(server),
+                             provider._rrset_hash(params))
+
+        self.assertNotEqual(provider._rrset_hash([{
+            'name': 'www',
+            'data': '1.1.1.1',
+            'ttl': 300,
+            'type': 'A'
+        }]), provider._rrset_hash([{
+            'name': 'www',
+            'data': '1.1.1.1',
+            'ttl': 300,
+            'type': 'A',
+            'weighted_config': {
+                'weighted_ips': [{'ip': '2.2.2.2', 'weight': 10}]
+            }
+        }]))
+
+    def test_apply_value_deltas(self):
+        provider = ScalewayProvider('test', 'token')
+        ips = [f'10.0.0.{n}' for n in range(20)]
+        provider._client.zone_records = Mock(return_value=[{
+            'id': str(n),
+            'name': 'www',
+            'data': ip,
+            'ttl': 300,
+            'type': 'A'
+        } for n, ip in enumerate(ips)] + [{
+            'name': 'txt',
+            'data': '"a"',
+            'ttl': 300,
+            'type': 'TXT'
+        }, {
+            'name': 'geo',
+            'data': '1.1.1.1',
+            'ttl': 300,
+            'type': 'A',
+            'geo_ip_config': {
+                'matches': [{
+                    'continents': ['EU'],
+                    'countries': [],
+                    'data': '2.2.2.2'
+                }],
+                'default': ''
+            }
+        }] + [{
+            'name': 'ttl',
+            'data': ip,
+            'ttl': 300,
+            'type': 'A'
+        } for ip in ips])
+        provider._client.record_updates = Mock()
+
+        desired = Zone('unit.tests.', [])
+        # one value out of 20 replaced
+        desired.add_record(Record.new(desired, 'www', {
+            'ttl': 300,
+            'type': 'A',
+            'values': ips[1:] + ['10.0.1.0']
+        }))
+        # small sets are replaced as a whole
+        desired.add_record(Record.new(desired, 'txt', {
+            'ttl': 300,
+            'type': 'TXT',
+            'value': 'b'
+        }))
+        # as well as dynamic ones and those changing their ttl
+        desired.add_record(Record.new(desired, 'geo', {
+            'ttl': 300,
+            'type': 'A',
+            'value': '1.1.1.2',
+            'dynamic': {
+                'pools': {
+                    'pool-0': {'values': [{'value': '2.2.2.2'}]}
+                },
+                'rules': [{'pool': 'pool-0', 'geos': ['EU']}]
+            }
+        }))
+        desired.add_record(Record.new(desired, 'ttl', {
+            'ttl': 600,
+            'type': 'A',
+            'values': ips[1:]
+        }))
+
+        plan = provider.plan(desired)
+        self.assertEqual(4, len(plan.changes))
+        provider.apply(plan)
+        changes = provider._client.record_updates.call_args[0][1]['changes']
+        self.assertEqual([{
+            'delete': {
+                'idFields': {
+                    'type': 'A',
+                    'name': 'www',
+                    'data': '10.0.0.0'
+                }
+            }
+        }, {
+            'add': {
+                'records': [{
+                    'name': 'www',
+                    'ttl': 300,
+                    'type': 'A',
+                    'data': '10.0.1.0'
+                }]
+            }
+        }], [c for c in changes if 'set' not in c])
+        self.assertEqual([
+            ('geo', 'A', 1),
+            ('ttl', 'A', 19),
+            ('txt', 'TXT', 1),
+        ], sorted((c['set']['idFields']['name'], c['set']['idFields']['type'],
+                   len(c['set']['records'])) for c in changes
+                  if 'set' in c))
+
+        # only removals
+        self.assertEqual([{
+            'delete': {
+                'idFields': {
+                    'type': 'A',
+                    'name': 'www',
+                    'data': '10.0.0.0'
+                }
+            }
+        }], provider._params_delta({
+            'set': {
+                'idFields': {'type': 'A', 'name': 'www'},
+                'records': [{
+                    'name': 'www',
+                    'ttl': 300,
+                    'type': 'A',
+                    'data': ip
+                } for ip in ips[1:]]
+            }
+        }, [{
+            'name': 'www',
+            'ttl': 300,
+            'type': 'A',
+            'data': ip
+        } for ip in ips]))
+
+    def test_refresh_rrset(self):
+        provider = ScalewayProvider('test', 'token')
+        zone = Zone('unit.tests.', [])
+        provider._zone_records[zone.name] = [{
+            'name': 'www',
+            'data': '1.2.3.4',
+            'ttl': 300,
+            'type': 'A'
+        }, {
+            'name': 'www',
+            'data': '"txt"',
+            'ttl': 300,
+            'type': 'TXT'
+        }]
+        provider._client.get_records = Mock(return_value=[{
+            'name': 'www',
+            'data': '2.2.3.4',
+            'ttl': 600,
+            'type': 'A'
+        }])
+
+        record = provider.refresh_rrset(zone, 'www', 'A')
+        provider._client.get_records.assert_called_once_with(
+            'unit.tests', name='www', type='A')
+        self.assertEqual(['2.2.3.4'], record.values)
+        self.assertEqual(600, record.ttl)
+        self.assertEqual([{
+            'name': 'www',
+            'data': '"txt"',
+            'ttl': 300,
+            'type': 'TXT'
+        }, {
+            'name': 'www',
+            'data': '2.2.3.4',
+            'ttl': 600,
+            'type': 'A'
+        }], provider._zone_records[zone.name])
+
+        # missing record sets, zones not cached are left alone
+        provider._client.get_records.return_value = []
+        self.assertIsNone(provider.refresh_rrset(Zone('other.tests.', []),
+                                                 'www', 'A'))
+        self.assertNotIn('other.tests.', provider._zone_records)
+
+    def test_record_filters(self):
+        provider = ScalewayProvider('test', 'token')
+        self.assertEqual([{}], provider._record_filters())
+        self.assertTrue(provider._managed_name('anything'))
+
+        provider = ScalewayProvider('test', 'token', types=['TXT', 'SPF'],
+                                    include_names=['', 'www'])
+        self.assertEqual(set(['TXT', 'SPF']), provider.types)
+        self.assertIn('A', provider.SUPPORTS)
+        # SPF is stored as TXT, a single type is filtered by the API
+        self.assertEqual([{'name': '', 'type': 'TXT'},
+                          {'name': 'www', 'type': 'TXT'}],
+                         provider._record_filters())
+
+        provider = ScalewayProvider('test', 'token', types=['A', 'AAAA'],
+                                    include_names=['www', '/^mail/'])
+        self.assertEqual([{}], provider._record_filters())
+        self.assertTrue(provider._managed_name('www'))
+        self.assertTrue(provider._managed_name('mail2'))
+        self.assertFalse(provider._managed_name('www2'))
+        self.assertFalse(provider._managed_name('smtp'))
+
+        # the records of other names and types are dropped on read
+        records = [
+            {'name': 'www', 'type': 'A', 'data': '1.1.1.1', 'ttl': 300},
+            {'name': 'www', 'type': 'TXT', 'data': '"a"', 'ttl': 300},
+            {'name': 'mail', 'type': 'AAAA', 'data': '::1', 'ttl': 300},
+            {'name': 'smtp', 'type': 'A', 'data': '1.1.1.2', 'ttl': 300},
+            {'name': 'www', 'type': 'SOA', 'data': 'ns0.unit.tests. '
+             'hostmaster.unit.tests. 1 2 3 4 5', 'ttl': 300},
+        ]
+        provider._client.zone_records = Mock(return_value=records)
+        self.assertEqual([records[0], records[2]],
+                         provider._fetch_zone_records('unit.tests'))
+        provider._client.zone_records.assert_called_once_with('unit.tests')
+
+        provider = ScalewayProvider('test', 'token', include_names=['www'])
+        provider._client.get_records = Mock(return_value=records[:2])
+        self.assertEqual(records[:2],
+                         provider._fetch_zone_records('unit.tests'))
+        provider._client.get_records.assert_called_once_with('unit.tests',
+                                                             name='www')
+
+        provider = ScalewayProvider('test', 'token', types=['A'],
+                                    stream_records=True)
+        provider._client.iter_zone_records = Mock(return_value=iter(records))
+        self.assertEqual([records[0], records[3]],
+                         provider._fetch_zone_records('unit.tests'))
+        provider._client.iter_zone_records.assert_called_once_with(
+            'unit.tests', type='A')
+
+        # SPF alone is read back from the TXT records holding SPF policies
+        provider = ScalewayProvider('test', 'token', types=['SPF'])
+        self.assertEqual([{'type': 'TXT'}], provider._record_filters())
+        spf = {'name': '', 'type': 'TXT', 'data': '"v=spf1 -all"',
+               'ttl': 300}
+        provider._client.get_records = Mock(return_value=records + [spf])
+        zone = Zone('unit.tests.', [])
+        provider.populate(zone)
+        self.assertEqual([('', 'SPF', ('v=spf1 -all',))],
+                         [(r.name, r._type, tuple(r.values))
+                          for r in zone.records])
+        provider._client.get_records.assert_called_once_with('unit.tests',
+                                                             type='TXT')
+        # refreshed from the TXT records too
+        provider._client.get_records = Mock(return_value=[
+            records[1] | {'name': ''}, spf])
+        record = provider.refresh_rrset(zone, '', 'SPF')
+        self.assertEqual(('', 'SPF', ['v=spf1 -all']),
+                         (record.name, record._type, record.values))
+        provider._client.get_records.assert_called_once_with(
+            'unit.tests', name='', type='TXT')
+        provider._client.get_records = Mock(return_value=[
+            records[1] | {'name': ''}])
+        self.assertIsNone(provider.refresh_rrset(zone, '', 'SPF'))
+        provider._client.get_records = Mock(return_value=[spf])
+        provider.refresh_rrset(zone, '', 'SPF')
+        # nor are the record sets of other types refreshed
+        provider._client.get_records = Mock(return_value=records[:1])
+        provider.refresh_rrset(zone, 'www', 'A')
+        zone = Zone('unit.tests.', [])
+        provider.populate(zone)
+        self.assertEqual(['SPF'], [r._type for r in zone.records])
+
+        # and is written as TXT values, the other values of the set being
+        # left alone
+        verification = {'name': '', 'type': 'TXT', 'ttl': 300,
+                        'data': '"google-site-verification=abc"'}
+        provider._client.get_records = Mock(return_value=[verification, spf])
+        provider._client.record_updates = Mock()
+        provider._zone_records.clear()
+        wanted = Zone('unit.tests.', [])
+        wanted.add_record(Record.new(wanted, '', {
+            'ttl': 300,
+            'type': 'SPF',
+            'value': 'v=spf1 a -all',
+        }))
+        plan = provider.plan(wanted)
+        self.assertEqual(1, len(plan.changes))
+        provider.apply(plan)
+        self.assertEqual([{
+            'delete': {
+                'idFields': {
+                    'type': 'TXT',
+                    'name': '',
+                    'data': '"v=spf1 -all"'
+                }
+            }
+        }, {
+            'add': {
+                'records': [{
+                    'name': '@',
+                    'ttl': 300,
+                    'type': 'TXT',
+                    'data': '"v=spf1 a -all"'
+                }]
+            }
+        }], provider._client.record_updates.call_args[0][1]['changes'])
+
+        provider._client.record_updates.reset_mock()
+        plan = provider.plan(Zone('unit.tests.', []))
+        self.assertEqual(1, len(plan.changes))
+        provider.apply(plan)
+        self.assertEqual([{
+            'delete': {
+                'idFields': {
+                    'type': 'TXT',
+                    'name': '',
+                    'data': '"v=spf1 -all"'
+                }
+            }
+        }], provider._client.record_updates.call_args[0][1]['changes'])
+
+        # nothing is sent when the values are the same
+        provider._client.record_updates.reset_mock()
+        existing = Zone('unit.tests.', [])
+        provider.populate(existing)
+        record = next(iter(existing.records))
+        provider.apply(Plan(existing, wanted, [Update(record, record)], True))
+        provider._client.record_updates.assert_not_called()
+
+        # nor those of other names
+        provider = ScalewayProvider('test', 'token', include_names=['www'])
+        provider._client.get_records = Mock(return_value=records[:1])
+        zone = Zone('unit.tests.', [])
+        provider.populate(zone)
+        provider._client.get_records = Mock(return_value=[records[3]])
+        provider.refresh_rrset(zone, 'smtp', 'A')
+        self.assertIn(records[3], provider._zone_records['unit.tests.'])
+        wanted = Zone('unit.tests.', [])
+        wanted.add_record(Record.new(wanted, 'www', {
+            'ttl': 300,
+            'type': 'A',
+            'value': '1.1.1.1',
+        }))
+        self.assertIsNone(provider.plan(wanted))
+
+        # desired records that aren't managed are left alone, without
+        # warnings even when the supports are strict
+        provider = ScalewayProvider('test', 'token', include_names=['www'],
+                                    types=['A'], strict_supports=True)
+        desired = Zone('unit.tests.', [])
+        for name in ('www', 'smtp'):
+            desired.add_record(Record.new(desired, name, {
+                'ttl': 300,
+                'type': 'A',
+                'value': '1.1.1.1',
+            }))
+        desired.add_record(Record.new(desired, 'www', {
+            'ttl': 300,
+            'type': 'TXT',
+            'value': 'a',
+        }))
+        desired = provider._process_desired_zone(desired)
+        self.assertEqual([('www', 'A')],
+                         [(r.name, r._type) for r in desired.records])
+
+    def test_bulk_import(self):
+        provider = ScalewayProvider('test', 'token', bulk_import_threshold=4)
+        provider.CHUNK_SIZE = 2
+        ns = {'name': '', 'type': 'NS', 'data': 'ns0.dom.scw.cloud.',
+              'ttl': 1800}
+        provider._client.zone_records = Mock(return_value=[ns])
+        provider._client.import_bind_zone = Mock()
+        provider._client.record_updates = Mock()
+
+        wanted = Zone('unit.tests.', [])
+        for name, data in (
+            ('', {'type': 'ALIAS', 'value': 'www.unit.tests.'}),
+            ('www', {'type': 'A', 'values': ['1.2.3.4', '1.2.3.5']}),
+            ('mx', {'type': 'MX', 'value': {
+                'preference': 10,
+                'exchange': 'mx.unit.tests.'
+            }}),
+            ('txt', {'type': 'TXT', 'value': 'v=spf1 -all'}),
+            ('dynamic', {'type': 'A', 'value': '1.1.1.1', 'dynamic': {
+                'pools': {
+                    'pool-0': {'values': [{'value': '2.2.2.2'}]},
+                    'pool-1': {'values': [{'value': '1.1.1.1'}]}
+                },
+                'rules': [{'geos': ['EU'], 'pool': 'pool-0'},
+                          {'pool': 'pool-1'}]
+            }}),
+        ):
+            wanted.add_record(Record.new(wanted, name, dict(data, ttl=300),
+                                         lenient=True))
+        plan = provider.plan(wanted)
+
+        # the records a zone file can hold are imported, the others patched
+        provider.apply(plan)
+        provider._client.import_bind_zone.assert_called_once_with(
+            'unit.tests', '$ORIGIN unit.tests.\n'
+            '@ 1800 IN NS ns0.dom.scw.cloud.\n'
+            'mx 300 IN MX 10 mx.unit.tests.\n'
+            'txt 300 IN TXT "v=spf1 -all"\n'
+            'www 300 IN A 1.2.3.4\n'
+            'www 300 IN A 1.2.3.5\n')
+        self.assertEqual(1, provider._client.record_updates.call_count)
+        changes = provider._client.record_updates.call_args[0][1]['changes']
+        self.assertEqual(['@', 'dynamic'],
+                         [c['add']['records'][0]['name'] for c in changes])
+
+        # chunked PATCHes when the import fails
+        provider._client.zone_records.side_effect = ScalewayClientNotFound()
+        provider._client.import_bind_zone.reset_mock()
+        provider._client.import_bind_zone.side_effect = \
+            ScalewayClientBadRequest()
+        provider._client.record_updates.reset_mock()
+        provider.apply(plan)
+        provider._client.import_bind_zone.assert_called_once()
+        self.assertEqual([2, 2, 1], [
+            len(c[0][1]['changes'])
+            for c in provider._client.record_updates.call_args_list
+        ])
+
+        # or when the zone already holds records
+        provider._client.zone_records.side_effect = None
+        provider._client.zone_records.return_value = [ns, {
+            'name': 'old', 'type': 'A', 'data': '1.1.1.1', 'ttl': 300
+        }]
+        provider._client.import_bind_zone.reset_mock()
+        provider._client.record_updates.reset_mock()
+        provider.apply(plan)
+        provider._client.import_bind_zone.assert_not_called()
+        self.assertEqual(3, provider._client.record_updates.call_count)
+
+        # below the threshold, or without it, a single PATCH
+        for threshold in (7, None):
+            provider.bulk_import_threshold = threshold
+            provider._client.record_updates.reset_mock()
+            provider.apply(plan)
+            provider._client.import_bind_zone.assert_not_called()
+            self.assertEqual(1, provider._client.record_updates.call_count)
+
+    def test_populate_processes(self):
+        with open('tests/fixtures/scaleway-ok.json') as fh:
+            records = json.load(fh)['records']
+
+        expected = Zone('unit.tests.', [])
+        provider = ScalewayProvider('test', 'token')
+        provider._client.zone_records = Mock(return_value=records)
+        provider.populate(expected)
+
+        # the same records built from data converted on a process pool
+        zone = Zone('unit.tests.', [])
+        provider = ScalewayProvider('test', 'token', populate_processes=2,
+                                    populate_process_threshold=10)
+        provider._client.zone_records = Mock(return_value=records)
+        with patch('octodns_scaleway.ProcessPoolExecutor',
+                   wraps=ProcessPoolExecutor) as executor:
+            self.assertTrue(provider.populate(zone))
+            self.assertEqual(15, len(zone.records))
+            self.assertFalse(expected.changes(zone, provider))
+            # the records are bound to the zone populated
+            self.assertEqual(set([(zone, provider)]),
+                             set((r.zone, r.source) for r in zone.records))
+
+            # the pool is kept for the next zones, the records built in it
+            # being validated there
+            provider._zone_records = {}
+            provider._rrset_data = {}
+            invalid = records + [{'name': 'bad', 'type': 'CNAME',
+                                  'data': 'relative', 'ttl': 300}]
+            provider._client.zone_records = Mock(return_value=invalid)
+            with self.assertRaises(ValidationError) as ctx:
+                provider.populate(Zone('unit.tests.', []))
+            self.assertEqual('bad.unit.tests.', ctx.exception.fqdn)
+
+            # unless lenient, neither raising nor reusing them
+            provider._zone_records = {}
+            zone = Zone('unit.tests.', [])
+            provider.populate(zone, lenient=True)
+            self.assertEqual(16, len(zone.records))
+            self.assertNotIn(('bad', 'CNAME'),
+                             provider._rrset_data['unit.tests.'])
+
+            # nothing to build
+            provider._zone_records = {}
+            provider._client.zone_records = Mock(return_value=records)
+            provider.populate_process_threshold = 0
+            provider.populate(Zone('unit.tests.', []))
+        executor.assert_called_once()
+        self.assertEqual(2, executor.call_args[0][0])
+        self.assertEqual('spawn',
+                         executor.call_args[1]['mp_context']
+                         .get_start_method())
+
+        # small zones stay in-process, converted by the provider
+        provider._zone_records = {}
+        provider._rrset_data = {}
+        provider.populate_process_threshold = 100
+        zone = Zone('unit.tests.', [])
+        with patch('octodns_scaleway._records_for_groups') as build, \
+                patch.object(provider, '_data_for_A',
+                             return_value={'type': 'A', 'ttl': 42,
+                                           'value': '4.3.2.1'}):
+            provider.populate(zone)
+        build.assert_not_called()
+        self.assertEqual(set([42]), set(r.ttl for r in zone.records
+                                        if r._type == 'A'))
+
+        with patch.object(provider._populate_executor, 'shutdown') as \
+                shutdown:
+            provider.close()
+        shutdown.assert_called_once_with()
+        provider._populate_executor.shutdown()
+
+        # what the workers return, the records built on a scratch zone
+        (data, record, reasons), (_, invalid, reasons_invalid) = \
+            _records_for_groups('unit.tests.', [
+                ('www', 'A', [{'name': 'www', 'type': 'A',
+                               'data': '1.2.3.4', 'ttl': 300}]),
+                ('bad', 'CNAME', [{'name': 'bad', 'type': 'CNAME',
+                                   'data': 'relative', 'ttl': 300}]),
+            ])
+        self.assertEqual({'type': 'A', 'ttl': 300, 'values': ['1.2.3.4']},
+                         data)
+        self.assertEqual(('www.unit.tests.', None),
+                         (record.fqdn, record.source))
+        self.assertIsNone(reasons)
+        self.assertIsNone(invalid)
+        self.assertEqual(['CNAME value "relative" is not a valid FQDN'],
+                         reasons_invalid)
+
+    def test_populate_reuses_rrsets(self):
+        with open('tests/fixtures/scaleway-ok.json') as fh:
+            records = json.load(fh)['records']
+        provider = ScalewayProvider('test', 'token')
+
+        def populate(lenient=False):
+            # fetched again from the API each time
+            provider._zone_records = {}
+            provider._client.zone_records = Mock(
+                return_value=deepcopy(records))
+            zone = Zone('unit.tests.', [])
+            with patch.object(provider, '_data_for_groups',
+                              wraps=provider._data_for_groups) as convert:
+                provider.populate(zone, lenient=lenient)
+            return zone, [g[:2] for g in convert.call_args[0][0]]
+
+        expected, converted = populate()
+        self.assertEqual(15, len(converted))
+        zone, converted = populate()
+        self.assertEqual([], converted)
+        self.assertEqual(15, len(zone.records))
+        self.assertFalse(expected.changes(zone, provider))
+        # the records are new ones, bound to the zone populated
+        self.assertEqual(set([zone]), set(r.zone for r in zone.records))
+
+        # only the record sets that changed are built again
+        records = [dict(r, data='2001:db8::1') if r['name'] == 'b' else r
+                   for r in records]
+        records[0] = dict(records[0], ttl=42)
+        records.append({'name': 'new', 'type': 'A', 'data': '1.2.3.4',
+                        'ttl': 300})
+        zone, converted = populate()
+        self.assertEqual(sorted([(records[0]['name'], records[0]['type']),
+                                 ('b', 'AAAA'), ('new', 'A')]),
+                         sorted(converted))
+        self.assertEqual(16, len(zone.records))
+        self.assertEqual(set(['b', 'new']), set(r.name for r in zone.records
+                                                if r.name in ('b', 'new')))
+
+        # invalid record sets are only accepted when lenient, never reused
+        records = [dict(r, data='missing.dot') if r['name'] == 'cname'
+                   else r for r in records]
+        with self.assertRaises(ValidationError):
+            populate()
+        zone, converted = populate(lenient=True)
+        self.assertEqual([('cname', 'CNAME')], converted)
+        zone, converted = populate(lenient=True)
+        self.assertEqual([('cname', 'CNAME')], converted)
+
+    def test_populate_cached_records_immutable(self):
+        with open('tests/fixtures/scaleway-ok.json') as fh:
+            records = json.load(fh)['records']
+        snapshot = deepcopy(records)
+        provider = ScalewayProvider('test', 'token')
+        provider._client.zone_records = Mock(return_value=records)
+
+        expected = Zone('unit.tests.', [])
+        provider.populate(expected)
+        self.assertEqual(snapshot, records)
+
+        # many threads converting the same cached records at once
+        start = Event()
+
+        def populate(_):
+            start.wait(5)
+            # no reuse of the data of previous populates
+            provider._rrset_data = {}
+            zone = Zone('unit.tests.', [])
+            provider.populate(zone)
+            return zone
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            futures = [executor.submit(populate, n) for n in range(64)]
+            start.set()
+            zones = [f.result() for f in futures]
+
+        provider._client.zone_records.assert_called_once()
+        self.assertEqual(snapshot, provider._zone_records['unit.tests.'])
+        for zone in zones:
+            self.assertEqual(15, len(zone.records))
+            self.assertFalse(expected.changes(zone, provider))
+
+    def test_stale_while_revalidate(self):
+        provider = ScalewayProvider('test', 'token', cache_ttl=100)
+        self.assertEqual(20, provider.refresh_ahead)
+        for refresh_ahead in (0, 100, 150):
+            with self.assertRaises(ScalewayProviderException) as ctx:
+                ScalewayProvider('test', 'token', cache_ttl=100,
+                                 refresh_ahead=refresh_ahead)
+            self.assertEqual(f'test: refresh_ahead {refresh_ahead} must be '
+                             'between 0 and cache_ttl 100',
+                             str(ctx.exception))
+        zone = Zone('unit.tests.', [])
+        versions = [[{'name': 'www', 'type': 'A', 'data': f'1.1.1.{n}',
+                      'ttl': 300}] for n in range(6)]
+        provider._client.zone_records = Mock(side_effect=versions)
+
+        def fetched(count):
+            for _ in range(100):
+                if provider._client.zone_records.call_count == count and \
+                   not provider._zone_records_fetches:
+                    return True
+                sleep(0.01)
+
+        with patch('octodns_scaleway.monotonic') as now:
+            now.return_value = 0
+            self.assertEqual(versions[0], provider.zone_records(zone))
+            self.assertTrue(provider._refresher_thread.is_alive())
+            now.return_value = 50
+            self.assertEqual(versions[0], provider.zone_records(zone))
+            self.assertTrue(fetched(1))
+
+            # refreshed in the background before expiring
+            now.return_value = 90
+            self.assertEqual(versions[0], provider.zone_records(zone))
+            self.assertTrue(fetched(2))
+            self.assertEqual(versions[1], provider.zone_records(zone))
+
+            # expired, the stale copy is served while refreshed
+            now.return_value = 200
+            self.assertEqual(versions[1], provider.zone_records(zone))
+            self.assertTrue(fetched(3))
+            self.assertEqual(versions[2], provider.zone_records(zone))
+
+            # unless fresh records are required
+            now.return_value = 400
+            self.assertEqual(versions[3],
+                             provider.zone_records(zone, fresh=True))
+            self.assertTrue(fetched(4))
+            now.return_value = 600
+            provider.strict_freshness = True
+            self.assertEqual(versions[4], provider.zone_records(zone))
+            self.assertTrue(fetched(5))
+            provider.strict_freshness = False
+
+            # failed refreshes keep the stale copy
+            now.return_value = 800
+            provider._client.zone_records.side_effect = \
+                ScalewayClientBadRequest()
+            self.assertEqual(versions[4], provider.zone_records(zone))
+            self.assertTrue(fetched(6))
+            self.assertEqual(versions[4], provider.zone_records(zone))
+            self.assertTrue(fetched(7))
+
+            # a single refresh at a time
+            provider._zone_records_fetches[zone.name] = Future()
+            self.assertEqual(versions[4], provider.zone_records(zone))
+            provider._zone_records_fetches.clear()
+            self.assertTrue(fetched(7))
+
+            # deleted zones are dropped
+            provider._client.zone_records.side_effect = \
+                ScalewayClientNotFound()
+            self.assertEqual(versions[4], provider.zone_records(zone))
+            self.assertTrue(fetched(8))
+            self.assertFalse(provider._zone_records)
+            self.assertEqual([], provider.zone_records(zone))
+
+        provider.close()
+        provider._refresher_thread.join(5)
+        self.assertFalse(provider._refresher_thread.is_alive())
+
+        # the refresher renews the zones about to expire on its own
+        provider = ScalewayProvider('test', 'token', cache_ttl=0.2,
+                                    refresh_ahead=0.1)
+        provider._client.zone_records = Mock(return_value=versions[0])
+        provider.zone_records(zone)
+        self.assertTrue(fetched(3))
+        provider.close()
+        # without a cache ttl the records are kept until applied
+        provider = ScalewayProvider('test', 'token')
+        provider._client.zone_records = Mock(return_value=versions[0])
+        provider.zone_records(zone)
+        provider.zone_records(zone)
+        provider._client.zone_records.assert_called_once()
+        self.assertIsNone(provider._refresher_thread)
+        provider.close()
+
+    def test_apply_journal(self):
+        with TemporaryDirectory() as tmpdir:
+            # created when needed
+            journal_path = join(tmpdir, 'journal')
+            provider = ScalewayProvider('test', 'token',
+                                        journal_path=journal_path)
+            provider.CHUNK_SIZE = 2
+            path = join(journal_path, 'unit.tests.journal')
+            server = []
+            provider._client.zone_records = Mock(
+                side_effect=lambda zone: list(server))
+
+            wanted = Zone('unit.tests.', [])
+            for n in range(5):
+                wanted.add_record(Record.new(wanted, f'www{n}', {
+                    'ttl': 300,
+                    'type': 'A',
+                    'value': f'1.2.3.{n}'
+                }))
+            plan = provider.plan(wanted)
+
+            sent = []
+            cut = [2]
+
+            # the connection is cut after the second chunk landed
+            def record_updates(zone, data):
+                sent.append([c['add']['records'][0]['name']
+                             for c in data['changes']])
+                for change in data['changes']:
+                    server.extend(change['add']['records'])
+                if len(sent) == cut[0]:
+                    raise ConnectionError()
+
+            provider._client.record_updates = Mock(side_effect=record_updates)
+            with self.assertRaises(ConnectionError):
+                provider.apply(plan)
+            self.assertEqual([['www0', 'www1'], ['www2', 'www3']], sent)
+            with open(path) as fh:
+                journal = [json.loads(line) for line in fh]
+            self.assertEqual({'desired': provider._desired_hash(wanted)},
+                             journal[0])
+            self.assertEqual(['started', 'done', 'started'],
+                             [e['state'] for e in journal[1:]])
+            self.assertEqual(2, len(journal[1]['changes']))
+            self.assertFalse(provider._zone_records)
+
+            # a new plan, against the half-applied zone, resumes
+            plan = provider.plan(wanted)
+            self.assertEqual(1, len(plan.changes))
+            sent.clear()
+            with self.assertLogs('ScalewayProvider[test]', 'INFO') as logs:
+                provider.apply(plan)
+            self.assertIn('INFO:ScalewayProvider[test]:_apply: resuming the '
+                          'interrupted apply of unit.tests.', logs.output)
+            self.assertEqual([['www4']], sent)
+            self.assertFalse(exists(path))
+
+            # so does the same plan applied again: the changes journaled as
+            # done are skipped, those in flight found on the server
+            server.clear()
+            plan = provider.plan(wanted)
+            sent.clear()
+            with self.assertRaises(ConnectionError):
+                provider.apply(plan)
+            cut[0] = None
+            sent.clear()
+            calls = provider._client.zone_records.call_count
+            provider.apply(plan)
+            self.assertEqual([['www4']], sent)
+            # read once to check the changes in flight
+            self.assertEqual(calls + 1, provider._client.zone_records
+                             .call_count)
+            self.assertFalse(exists(path))
+
+            # another desired state starts over
+            with open(path, 'w') as fh:
+                fh.write('{"desired":"other"}\n'
+                         '{"changes":["a"],"state":"done"}\n')
+            server.clear()
+            sent.clear()
+            provider.apply(plan)
+            self.assertEqual([['www0', 'www1'], ['www2', 'www3'], ['www4']],
+                             sent)
+            self.assertFalse(exists(path))
+
+            # a resumed bootstrap doesn't import again, what it brought is
+            # found on the server
+            provider.bulk_import_threshold = 5
+            provider._client.import_bind_zone = Mock()
+            with open(path, 'wb') as fh:
+                fh.write(_dumps({'desired': provider._desired_hash(wanted)}) +
+                         b'\n')
+            sent.clear()
+            provider.apply(plan)
+            provider._client.import_bind_zone.assert_not_called()
+            self.assertEqual([], sent)
+            self.assertFalse(exists(path))
+
+    def test_chunk_applied(self):
+        provider = ScalewayProvider('test', 'token')
+        rrsets = {
+            ('', 'A'): [{'name': '', 'type': 'A', 'data': '1.2.3.4',
+                         'ttl': 300}],
+            ('txt', 'TXT'): [{'name': 'txt', 'type': 'TXT',
+                              'data': '"a" "b"', 'ttl': 300}],
+        }
+
+        def applied(*chunk):
+            return provider._chunk_applied(chunk, rrsets)
+
+        a = {'name': '@', 'type': 'A', 'data': '1.2.3.4', 'ttl': 300}
+        self.assertTrue(applied({'add': {'records': [a]}}))
+        self.assertFalse(applied({'add': {'records': [
+            a, dict(a, data='1.2.3.5')
+        ]}}))
+        self.assertTrue(applied({'set': {
+            'idFields': {'name': 'txt', 'type': 'TXT'},
+            'records': [{'name': 'txt', 'type': 'TXT', 'data': '"ab"',
+                         'ttl': 300}]
+        }}))
+        self.assertFalse(applied({'set': {
+            'idFields': {'name': '', 'type': 'A'},
+            'records': [dict(a, ttl=60)]
+        }}))
+        self.assertTrue(applied({'delete': {
+            'idFields': {'name': 'www', 'type': 'A'}
+        }}))
+        self.assertFalse(applied({'delete': {
+            'idFields': {'name': '', 'type': 'A'}
+        }}))
+        self.assertTrue(applied({'delete': {
+            'idFields': {'name': '', 'type': 'A', 'data': '1.2.3.5'}
+        }}, {'add': {'records': [a]}}))
+        self.assertFalse(applied({'delete': {
+            'idFields': {'name': 'txt', 'type': 'TXT', 'data': '"ab"'}
+        }}))
+
+    def test_sync_timeout(self):
+        provider = ScalewayProvider('test', 'token', sync_timeout=60)
+        provider._client.zone_records = Mock(return_value=[])
+        provider._client.record_updates = Mock()
+
+        def plan_zones(*names):
+            ret = []
+            for name in names:
+                wanted = Zone(name, [])
+                wanted.add_record(Record.new(wanted, 'www', {
+                    'ttl': 300,
+                    'type': 'A',
+                    'value': '1.2.3.4'
+                }))
+                ret.append(provider.plan(wanted))
+            return ret
+
+        # a sync starts with the first zone read or planned
+        self.assertIsNone(provider._client.deadline)
+        a, b = plan_zones('a.tests.', 'b.tests.')
+        deadline = provider._client.deadline
+        self.assertAlmostEqual(monotonic() + 60, deadline, delta=5)
+        self.assertEqual(deadline, provider._deadline)
+        # and ends once the zones planned with changes are applied
+        provider.apply(a)
+        self.assertEqual(deadline, provider._client.deadline)
+        provider.apply(b)
+        self.assertIsNone(provider._deadline)
+        self.assertIsNone(provider._client.deadline)
+        sleep(0.01)
+        plan_zones('a.tests.')
+        self.assertGreater(provider._deadline, deadline)
+        provider._client.zone_records.reset_mock()
+        provider.end_sync()
+        self.assertIsNone(provider._client.deadline)
+        self.assertEqual(set(), provider._unfinished_zones)
+
+        # a plan only sync ends when a zone is read again by the next one
+        short = ScalewayProvider('test', 'token', sync_timeout=0.2)
+        short._client.zone_records = Mock(return_value=[])
+        wanted = Zone('a.tests.', [])
+        wanted.add_record(Record.new(wanted, 'www', {
+            'ttl': 300,
+            'type': 'A',
+            'value': '1.2.3.4'
+        }))
+        self.assertIsNotNone(short.plan(wanted))
+        sleep(0.25)
+        self.assertIsNotNone(short.plan(wanted))
+        self.assertEqual({'a.tests.'}, short._unfinished_zones)
+        # as does a no-change one
+        short = ScalewayProvider('test', 'token', sync_timeout=0.2)
+        short._client.zone_records = Mock(return_value=[])
+        self.assertIsNone(short.plan(Zone('b.tests.', [])))
+        sleep(0.25)
+        self.assertIsNone(short.plan(Zone('b.tests.', [])))
+        # and one only reading zones as a source
+        short = ScalewayProvider('test', 'token', sync_timeout=0.2)
+        short._client.zone_records = Mock(return_value=[])
+        short.populate(Zone('b.tests.', []))
+        sleep(0.25)
+        short.populate(Zone('b.tests.', []))
+        self.assertAlmostEqual(monotonic() + 0.2, short._deadline, delta=0.1)
+
+        # none without a timeout
+        other = ScalewayProvider('test', 'token')
+        other._client.zone_records = Mock(return_value=[])
+        other.populate(Zone('a.tests.', []))
+        self.assertIsNone(other._client.deadline)
+
+        # the background refreshes aren't part of any sync
+        def zone_records(zone_name):
+            self.assertIsNone(provider._client._thread_deadline())
+            return []
+
+        provider._client.deadline = monotonic() - 1
+        provider._client.zone_records.side_effect = zone_records
+        provider._refresh('a.tests.')
+        self.assertEqual([], provider._zone_records['a.tests.'])
+        provider._client.zone_records.side_effect = None
+        provider._client.deadline = None
+
+        plans = plan_zones('a.tests.', 'b.tests.', 'c.tests.')
+        # nothing to do
+        self.assertIsNone(provider.plan(Zone('d.tests.', [])))
+        self.assertEqual({'a.tests.', 'b.tests.', 'c.tests.'},
+                         provider._unfinished_zones)
+
+        provider.apply(plans[0])
+        self.assertEqual({'b.tests.', 'c.tests.'},
+                         provider._unfinished_zones)
+
+        # the deadline passes while applying, the zones not done are
+        # reported
+        provider._client.record_updates.side_effect = \
+            ScalewayClientDeadlineExceeded()
+        with self.assertRaises(ScalewayProviderDeadlineExceeded) as ctx:
+            provider.apply(plans[1])
+        self.assertEqual(['b.tests.', 'c.tests.'], ctx.exception.zones)
+        self.assertEqual('Deadline exceeded, zones not done:\n  - b.tests.\n'
+                         '  - c.tests.', str(ctx.exception))
+        self.assertNotIn('b.tests.', provider._zone_records)
+
+        # or while reading a zone
+        provider._client.zone_records.side_effect = \
+            ScalewayClientDeadlineExceeded()
+        with self.assertRaises(ScalewayProviderDeadlineExceeded) as ctx:
+            provider.populate(Zone('e.tests.', []))
+        self.assertEqual(['b.tests.', 'c.tests.', 'e.tests.'],
+                         ctx.exception.zones)
+
+        # once it passed, nothing is started
+        provider._deadline = monotonic() - 1
+        provider._client.record_updates.reset_mock()
+        with self.assertRaises(ScalewayProviderDeadlineExceeded) as ctx:
+            provider.apply(plans[2])
+        self.assertEqual(['b.tests.', 'c.tests.'], ctx.exception.zones)
+        provider._client.record_updates.assert_not_called()
+        provider._client.zone_records.reset_mock()
+        with self.assertRaises(ScalewayProviderDeadlineExceeded):
+            provider.populate(Zone('a.tests.', []))
+        provider._client.zone_records.assert_not_called()
+
+    def test_schedule(self):
+        # the critical jobs first, the long ones started along the short
+        # ones, shortest first
+        self.assertEqual(['c', 'big', 'a', 'b', 'e', 'huge', 'low'],
+                         _schedule({
+                             'a': (2, 1),
+                             'low': (3, 1),
+                             'big': (2, 50),
+                             'b': (2, 2),
+                             'c': (0, 900),
+                             'huge': (2, 40),
+                             'e': (2, 3),
+                         }, 2))
+        self.assertEqual(['a', 'b'], _schedule({'b': (2, 5), 'a': (2, 1)},
+                                               1))
+        self.assertEqual([], _schedule({}, 4))
+
+    def test_prefetch(self):
+        with self.assertRaises(ScalewayProviderException) as ctx:
+            ScalewayProvider('test', 'token',
+                             zone_priorities={'a.tests.': 'urgent'})
+        self.assertEqual('test: unknown priority urgent of a.tests., '
+                         'expected one of critical, high, normal, low',
+                         str(ctx.exception))
+
+        with TemporaryDirectory() as tmpdir:
+            path = join(tmpdir, 'snapshot.gz')
+            with gzip_open(path, 'wt') as fh:
+                fh.write('{"format":"octodns-scaleway-snapshot",'
+                         '"version":1}\n')
+                for zone_name, size in (('big.tests', 900),
+                                        ('small.tests', 2),
+                                        ('medium.tests', 50)):
+                    fh.write(json.dumps({'zone': zone_name, 'records': [
+                        {'name': f'www{n}', 'type': 'A', 'data': '1.2.3.4',
+                         'ttl': 300} for n in range(size)
+                    ]}) + '\n')
+
+            provider = ScalewayProvider('test', 'token', cost_snapshot=path,
+                                        zone_priorities={
+                                            'vip.tests.': 'critical',
+                                        })
+            read = []
+            sizes = {'big.tests': 1, 'medium.tests': 5, 'small.tests': 10}
+
+            def zone_records(zone_name):
+                read.append(zone_name)
+                if zone_name == 'gone.tests':
+                    raise ScalewayClientBadRequest()
+                return [{'name': '', 'type': 'A', 'data': '1.2.3.4',
+                         'ttl': 300}] * sizes.get(zone_name, 1)
+
+            provider._client.zone_records = Mock(side_effect=zone_records)
+            zone_names = ['big.tests.', 'small.tests.', 'medium.tests.',
+                          'new.tests.', 'vip.tests.', 'gone.tests.']
+            self.assertEqual(['gone.tests.'],
+                             provider.prefetch(zone_names, workers=1))
+            # the unknown zones cost the average of the known ones
+            self.assertEqual(['vip', 'small', 'medium', 'new', 'gone',
+                              'big'], [z[:-6] for z in read])
+            self.assertIn('medium.tests.', provider._zone_records)
+
+            # the sizes read since are used instead of the snapshot ones
+            read.clear()
+            provider._zone_records.clear()
+            self.assertEqual([], provider.prefetch(zone_names[:3],
+                                                   workers=1))
+            self.assertEqual(['big', 'medium', 'small'],
+                             [z[:-6] for z in read])
+
+        # without any size known
+        provider = ScalewayProvider('test', 'token')
+        provider._client.zone_records = Mock(return_value=[])
+        self.assertEqual([], provider.prefetch(['a.tests.', 'b.tests.']))
+        self.assertEqual(2, provider._client.zone_records.call_count)
+        self.assertEqual({'a.tests.': 0, 'b.tests.': 0},
+                         provider._zone_sizes)
+
+        # nothing is read past the deadline
+        provider._deadline = monotonic() - 1
+        provider._zone_records.clear()
+        provider._client.zone_records.reset_mock()
+        self.assertEqual(['a.tests.'], provider.prefetch(['a.tests.']))
+        provider._client.zone_records.assert_not_called()
+
+    def test_apply_plans(self):
+        provider = ScalewayProvider('test', 'token', zone_priorities={
+            'vip.tests.': 'high',
+        })
+        provider._client.zone_records = Mock(return_value=[])
+        applied = []
+
+        def record_updates(zone, data):
+            applied.append(zone)
+            if zone.startswith('bad'):
+                raise ScalewayClientBadRequest()
+
+        provider._client.record_updates = Mock(side_effect=record_updates)
+
+        plans = []
+        for zone_name, size in (('big.tests.', 30), ('vip.tests.', 20),
+                                ('small.tests.', 1), ('medium.tests.', 5)):
+            wanted = Zone(zone_name, [])
+            for n in range(size):
+                wanted.add_record(Record.new(wanted, f'www{n}', {
+                    'ttl': 300,
+                    'type': 'A',
+                    'value': '1.2.3.4'
+                }))
+            plans.append(provider.plan(wanted))
+
+        self.assertEqual(56, provider.apply_plans(plans, workers=1))
+        self.assertEqual(['vip', 'small', 'medium', 'big'],
+                         [z[:-6] for z in applied])
+
+        # several plans of a zone are refused, none of them being applied
+        applied.clear()
+        with self.assertRaises(ScalewayProviderException) as ctx:
+            provider.apply_plans(plans + plans[2:], workers=1)
+        self.assertEqual('Several plans for medium.tests., small.tests.',
+                         str(ctx.exception))
+        self.assertEqual([], applied)
+
+        # every plan is tried, the first failure raised
+        for zone_name in ('bad.tests.', 'bad2.tests.'):
+            wanted = Zone(zone_name, [])
+            wanted.add_record(Record.new(wanted, 'www', {
+                'ttl': 300,
+                'type': 'A',
+                'value': '1.2.3.4'
+            }))
+            plans.append(provider.plan(wanted))
+        applied.clear()
+        with self.assertRaises(ScalewayClientBadRequest):
+            provider.apply_plans(plans, workers=2)
+        self.assertEqual(6, len(applied))
+
+
+class TestScalewayClient(TestCase):
+
+    def test_compressed_transfer(self):
+        client = ScalewayClient('token', 'test', False)
+        self.assertEqual(ACCEPT_ENCODING,
+                         client._transport.headers['accept-encoding'])
+
+        with open('tests/fixtures/scaleway-ok.json', 'rb') as fh:
+            content = fh.read()
+        body = compress(content)
+
+        with requests_mock() as mock:
+            mock.get('/domain/v2beta1/dns-zones/unit.tests/records',
+                     content=body, headers={'content-encoding': 'gzip'})
+            mock.patch('/domain/v2beta1/dns-zones/unit.tests/records',
+                       text='{}')
+
+            records = client.zone_records('unit.tests')
+            self.assertEqual(json.loads(content)['records'], records)
+
+            client.record_updates('unit.tests', {'changes': []})
+            self.assertEqual({'changes': []}, mock.last_request.json())
+            self.assertEqual('application/json',
+                             mock.last_request.headers['content-type'])
+
+        metrics = client.metrics
+        self.assertEqual(2, metrics['requests'])
+        self.assertEqual(len(body) + 2, metrics['bytes_received'])
+        self.assertEqual(len(content), metrics['bytes_decoded'])
+        self.assertEqual(len(b'{"changes":[]}'), metrics['bytes_sent'])
+        self.assertGreater(metrics['decode_seconds'], 0)
+
+    def test_json_backend(self):
+        loads, dumps = _json_backend()
+        self.assertEqual({'a': [1]}, loads(dumps({'a': [1]})))
+
+        # falls back on the standard library without orjson
+        with patch.dict('sys.modules', {'orjson': None}):
+            loads, dumps = _json_backend()
+        self.assertIs(json.loads, loads)
+        self.assertEqual(b'{"a":[1]}', dumps({'a': [1]}))
+
+    def test_json_stream(self):
+        content = '{"total_count": 3, "records": [{"name": "é", "ttl": 60}' \
+            ', {"data": "a \\" ]"}, 42], "other": {"a": []}}'.encode()
+        # one byte at a time to split everything, multi-bytes chars included
+        stream = _JsonStream(content[i:i + 1] for i in range(len(content)))
+        self.assertEqual([{'name': 'é', 'ttl': 60}, {'data': 'a " ]'}, 42],
+                         list(stream.items('records')))
+        self.assertEqual({'total_count': 3, 'other': {'a': []}},
+                         stream.members)
+        self.assertEqual(len(content), stream.bytes)
+        self.assertGreater(stream.decode_seconds, 0)
+
+        stream = _JsonStream([b' { "records" : [ ] } '])
+        self.assertEqual([], list(stream.items('records')))
+        stream = _JsonStream([b'{}'])
+        self.assertEqual([], list(stream.items('records')))
+
+        for content, msg in (
+            (b'[]', "Expecting one of '{', got '['"),
+            (b'{"records": {}}', "Expecting an array for 'records'"),
+            (b'{"records": [1 2]}', "Expecting one of ',]', got '2'"),
+            (b'{"records": [1,', "Expecting value: line 1 column 1 (char "
+             "0)"),
+            (b'{"records": [{"a": 1', "Expecting ',' delimiter: line 1 "
+             "column 8 (char 7)"),
+        ):
+            with self.assertRaises(ValueError) as ctx:
+                list(_JsonStream([content]).items('records'))
+            self.assertEqual(msg, str(ctx.exception))
+
+    def test_zone_records_pages(self):
+        client = ScalewayClient('token', 'test', False)
+        client.PAGE_SIZE = 2
+        records = [{'name': f'www{n}', 'type': 'A'} for n in range(5)]
+
+        def page(request, context):
+            page = int(request.qs['page'][0])
+            self.assertEqual(['2'], request.qs['page_size'])
+            return json.dumps({
+                'total_count': len(records),
+                'records': records[(page - 1) * 2:page * 2]
+            })
+
+        with requests_mock() as mock:
+            mock.get('/domain/v2beta1/dns-zones/unit.tests/records',
+                     text=page)
+            self.assertEqual(records, client.zone_records('unit.tests'))
+            self.assertEqual(3, mock.call_count)
+            self.assertEqual(records,
+                             list(client.iter_zone_records('unit.tests')))
+            self.assertEqual(6, mock.call_count)
+
+            # complete pages stop once total_count is reached
+            records = records[:4]
+            self.assertEqual(records, client.zone_records('unit.tests'))
+            self.assertEqual(8, mock.call_count)
+            self.assertEqual(records,
+                             list(client.iter_zone_records('unit.tests')))
+            self.assertEqual(10, mock.call_count)
+
+        self.assertEqual(10, client.metrics['requests'])
+        self.assertEqual(client.metrics['bytes_received'],
+                         client.metrics['bytes_decoded'])
+
+        with requests_mock() as mock:
+            mock.get(ANY, status_code=403)
+            self.assertEqual([], client.zone_records('unit.tests'))
+            self.assertEqual([],
+                             list(client.iter_zone_records('unit.tests')))
+
+        # forbidden past the first page, the zone would be truncated
+        def forbidden(request, context):
+            if request.qs['page'] != ['1']:
+                context.status_code = 403
+            return json.dumps({'total_count': 5, 'records': records[:2]})
+
+        with requests_mock() as mock:
+            mock.get(ANY, text=forbidden)
+            with self.assertRaises(ScalewayClientForbidden):
+                client.zone_records('unit.tests')
+            with self.assertRaises(ScalewayClientForbidden):
+                list(client.iter_zone_records('unit.tests'))
+
+    def test_populate_stream_records(self):
+        provider = ScalewayProvider('test', 'token', stream_records=True)
+
+        with requests_mock() as mock:
+            with open('tests/fixtures/scaleway-ok.json') as fh:
+                mock.get('/domain/v2beta1/dns-zones/unit.tests/records',
+                         text=fh.read())
+
+            zone = Zone('unit.tests.', [])
+            self.assertTrue(provider.populate(zone))
+            self.assertEqual(15, len(zone.records))
+
+    def test_get_records(self):
+        client = ScalewayClient('token', 'test', False)
+        records = [
+            {'name': '', 'type': 'A', 'data': '1.1.1.1', 'ttl': 300},
+            {'name': 'www', 'type': 'A', 'data': '1.1.1.2', 'ttl': 300},
+            {'name': 'www.sub', 'type': 'A', 'data': '1.1.1.3', 'ttl': 300},
+        ]
+
+        with requests_mock() as mock:
+            mock.get('/domain/v2beta1/dns-zones/unit.tests/records',
+                     text=json.dumps({'records': records}))
+
+            self.assertEqual(records[1:2], client.get_records(
+                'unit.tests', name='www', type='A'))
+            self.assertEqual({
+                'name': ['www'],
+                'type': ['a'],
+                'page': ['1'],
+                'page_size': ['1000']
+            }, mock.last_request.qs)
+
+            # the apex can't be filtered by the API
+            self.assertEqual(records[:1], client.get_records('unit.tests',
+                                                             name=''))
+            self.assertEqual({
+                'page': ['1'],
+                'page_size': ['1000']
+            }, mock.last_request.qs)
+
+            self.assertEqual(records, client.get_records('unit.tests',
+                                                         type='A'))
+            self.assertEqual(['a'], mock.last_request.qs['type'])
+
+            # streaming filters the same way
+            self.assertEqual(records[:1], list(client.iter_zone_records(
+                'unit.tests', name='')))
+            self.assertEqual(records[1:2], list(client.iter_zone_records(
+                'unit.tests', name='www', type='A')))
+            self.assertEqual({
+                'name': ['www'],
+                'type': ['a'],
+                'page': ['1'],
+                'page_size': ['1000']
+            }, mock.last_request.qs)
+
+    def test_snapshot(self):
+        client = ScalewayClient('token', 'test', False)
+
+        with TemporaryDirectory() as tmpdir, requests_mock() as mock:
+            path = join(tmpdir, 'snapshot.gz')
+            with open('tests/fixtures/scaleway-ok.json') as fh:
+                mock.get('/domain/v2beta1/dns-zones/unit.tests/records',
+                         text=fh.read())
+            mock.get('/domain/v2beta1/dns-zones/empty.tests/records',
+                     text='{"records": []}')
+            mock.get('/domain/v2beta1/dns-zones/missing.tests/records',
+                     status_code=404)
+            # how the API tells about most of the missing zones
+            mock.get('/domain/v2beta1/dns-zones/mistyped.tests/records',
+                     status_code=403)
+
+            self.assertEqual(['unit.tests', 'empty.tests'],
+                             client.export_snapshot(['unit.tests',
+                                                     'missing.tests',
+                                                     'mistyped.tests',
+                                                     'empty.tests'], path))
+
+            expected = Zone('unit.tests.', [])
+            provider = ScalewayProvider('test', 'token')
+            provider.populate(expected)
+
+            # replayed without any request
+            mock.reset_mock()
+            source = ScalewaySnapshotSource('snapshot', path)
+            zone = Zone('unit.tests.', [])
+            self.assertTrue(source.populate(zone))
+            self.assertEqual(15, len(zone.records))
+            self.assertFalse(expected.changes(zone, provider))
+
+            zone = Zone('empty.tests.', [])
+            self.assertTrue(source.populate(zone))
+            self.assertEqual(0, len(zone.records))
+
+            for name in ('missing.tests.', 'mistyped.tests.'):
+                zone = Zone(name, [])
+                self.assertFalse(source.populate(zone))
+            self.assertFalse(mock.called)
+
+            # the snapshot is read once
+            with patch('octodns_scaleway.gzip_open') as gzip_open_mock:
+                self.assertEqual(source._client.zone_records('unit.tests'),
+                                 source._client.zone_records('unit.tests'))
+            gzip_open_mock.assert_not_called()
+            self.assertEqual({'unit.tests': 18, 'empty.tests': 0},
+                             source._client.zone_sizes())
+
+            # filters apply as on the API
+            records = source._client.get_records('unit.tests', name='e',
+                                                 type='MX')
+            self.assertEqual(set([('e', 'MX')]),
+                             set((r['name'], r['type']) for r in records))
+            source = ScalewaySnapshotSource('snapshot', path, types=['A'],
+                                            stream_records=True)
+            zone = Zone('unit.tests.', [])
+            source.populate(zone)
+            self.assertEqual(set(['A']), set(r._type for r in zone.records))
+
+            # snapshots are read only
+            plan = Mock()
+            with self.assertRaises(ScalewayProviderException) as ctx:
+                source._apply(plan)
+            self.assertEqual('snapshot: snapshots are read only',
+                             str(ctx.exception))
+            source.close()
+
+            # whatever the escaping of the names
+            with gzip_open(path, 'wt') as fh:
+                fh.write('{"format":"octodns-scaleway-snapshot",'
+                         '"version":1}\n')
+                fh.write(json.dumps({'zone': 'ex\u00e4mple.tests',
+                                     'records': []}) + '\n')
+            self.assertIn('\\u00e4', _gzip_text(path))
+            source = ScalewaySnapshotSource('snapshot', path)
+            self.assertEqual([], source._client.zone_records(
+                'ex\u00e4mple.tests'))
+
+            # newer formats are refused
+            with gzip_open(path, 'wb') as fh:
+                fh.write(b'{"format":"octodns-scaleway-snapshot",'
+                         b'"version":2}\n')
+            source = ScalewaySnapshotSource('snapshot', path)
+            with self.assertRaises(ScalewayProviderException) as ctx:
+                source._client.zone_records('unit.tests')
+            self.assertIn('unsupported snapshot', str(ctx.exception))
+
+    def test_snapshot_main(self):
+        with TemporaryDirectory() as tmpdir, requests_mock() as mock, \
+                patch.dict('os.environ', {'SCALEWAY_SECRET_KEY': 'token'}):
+            path = join(tmpdir, 'snapshot.gz')
+            mock.get('/domain/v2beta1/dns-zones/unit.tests/records',
+                     text='{"records": []}')
+            mock.get('/domain/v2beta1/dns-zones/missing.tests/records',
+                     status_code=404)
+
+            snapshot_main(['--output', path, 'unit.tests'])
+            self.assertEqual('token',
+                             mock.last_request.headers['x-auth-token'])
+            with gzip_open(path, 'rb') as fh:
+                self.assertEqual([
+                    b'{"format":"octodns-scaleway-snapshot","version":1}\n',
+                    b'{"zone":"unit.tests","records":[]}\n',
+                ], fh.readlines())
+
+            with self.assertRaises(SystemExit) as ctx:
+                snapshot_main(['--output', path, 'unit.tests',
+                               'missing.tests'])
+            self.assertEqual(1, ctx.exception.code)
+
+            # without the secret key
+            with self.assertRaises(SystemExit) as ctx, \
+                    patch('sys.stderr', new_callable=StringIO) as stderr:
+                snapshot_main(['--token-env', 'UNSET_SECRET_KEY', '--output',
+                               path, 'unit.tests'])
+            self.assertEqual(2, ctx.exception.code)
+            self.assertIn('the environment variable UNSET_SECRET_KEY',
+                          stderr.getvalue())
+
+    def test_import_bind_zone(self):
+        client = ScalewayClient('token', 'test', False)
+
+        with requests_mock() as mock:
+            mock.post('/domain/v2beta1/dns-zones/unit.tests/raw', text='{}')
+            client.import_bind_zone('unit.tests', '@ 300 IN A 1.2.3.4\n')
+            self.assertEqual({
+                'bind_source': {'content': '@ 300 IN A 1.2.3.4\n'}
+            }, mock.last_request.json())
+
+    def test_aimd_limiter(self):
+        limiter = _AimdLimiter(6)
+        self.assertEqual(4, limiter.limit)
+
+        # additive increase after a limit's worth of healthy requests
+        for _ in range(4):
+            limiter.release(limiter.acquire(), 0.1, True)
+        self.assertEqual(5, limiter.limit)
+        for _ in range(10):
+            limiter.release(limiter.acquire(), 0.1, True)
+        self.assertEqual(6, limiter.limit)
+
+        # multiplicative decrease, once for requests in flight together
+        generations = [limiter.acquire() for _ in range(3)]
+        limiter.release(generations[0], 0.1, False)
+        self.assertEqual(3, limiter.limit)
+        limiter.release(generations[1], 0.1, False)
+        limiter.release(generations[2], 0.1, True)
+        self.assertEqual(3, limiter.limit)
+
+        # latency spikes count as errors
+        limiter.release(limiter.acquire(), 0.5, True)
+        self.assertEqual(1, limiter.limit)
+        # compared with the requests of the same kind only, slow ones having
+        # a baseline of their own
+        limiter = _AimdLimiter(6)
+        for _ in range(5):
+            limiter.release(limiter.acquire(), 0.1, True, 'fast')
+        for _ in range(5):
+            limiter.release(limiter.acquire(), 2, True, 'slow')
+        self.assertEqual(6, limiter.limit)
+        limiter.release(limiter.acquire(), 0.5, True, 'fast')
+        self.assertEqual(3, limiter.limit)
+        limiter.release(limiter.acquire(), 0.1, False)
+        self.assertEqual(1, limiter.limit)
+
+        # callers wait for a slot
+        generation = limiter.acquire()
+        acquired = Event()
+
+        def acquire():
+            limiter.acquire()
+            acquired.set()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(acquire)
+            self.assertFalse(acquired.wait(0.1))
+            limiter.release(generation, 0.1, True)
+            self.assertTrue(acquired.wait(5))
+
+        # or give up after their timeout
+        limiter = _AimdLimiter(1)
+        limiter.acquire()
+        self.assertIsNone(limiter.acquire(0.01))
+
+    @pytest.mark.usefixtures('enable_network')
+    def test_adaptive_concurrency(self):
+        # off unless enabled
+        client = ScalewayClient('token', 'test', False)
+        self.assertIsNone(client._limiter)
+        self.assertNotIn('concurrency_limit', client.metrics)
+
+        client = ScalewayClient('token', 'test', False, max_concurrency=16,
+                                adaptive_concurrency=True)
+        server = _ThrottlingServer(3)
+        Thread(target=server.serve_forever, daemon=True).start()
+        client.endpoint = f'http://127.0.0.1:{server.server_address[1]}' \
+            '/domain/v2beta1'
+
+        def worker(_):
+            throttled = 0
+            for _ in range(20):
+                try:
+                    client.get_records('unit.tests')
+                except HTTPError:
+                    throttled += 1
+            return throttled
+
+        try:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                throttled = sum(executor.map(worker, range(8)))
+
+            # a streamed body holds its slot until it's read
+            limiter = client._limiter
+            records = client.iter_zone_records('unit.tests')
+            self.assertEqual(1, len([next(records)]))
+            self.assertEqual(1, limiter._in_flight)
+            self.assertEqual(1, len(list(records)))
+            self.assertEqual(0, limiter._in_flight)
+            # the latency baseline of the reads of any zone
+            self.assertEqual([('GET', '/dns-zones/{}/records', 1000)],
+                             list(limiter._latency))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        metrics = client.metrics
+        self.assertEqual(161, metrics['requests'])
+        self.assertEqual(throttled, metrics['throttled'])
+        # the limit saws around what the server accepts instead of the 8
+        # workers hammering it, which gets about a third of their requests
+        # throttled
+        self.assertLess(throttled, 32)
+        self.assertGreaterEqual(metrics['concurrency_limit'], 1)
+
+    def test_shared_token_bucket(self):
+        with TemporaryDirectory() as tmpdir:
+            path = join(tmpdir, 'bucket.db')
+            with patch('octodns_scaleway.time', return_value=1000):
+                # two processes, tokens reserved one after the other
+                a = _SharedTokenBucket(path, 'account', 10, 2)
+                b = _SharedTokenBucket(path, 'account', 10, 2)
+                self.assertEqual([0, 0], [a.reserve(), b.reserve()])
+                self.assertAlmostEqual(0.1, a.reserve())
+                self.assertAlmostEqual(0.2, b.reserve())
+                # other accounts have their own bucket
+                other = _SharedTokenBucket(path, 'other', 10, 2)
+                self.assertEqual(0, other.reserve())
+            with patch('octodns_scaleway.time', return_value=1001):
+                # refilled up to the burst
+                self.assertEqual([0, 0], [a.reserve(), b.reserve()])
+                self.assertAlmostEqual(0.1, a.reserve())
+
+            # a connection per thread, kept for its next reservations
+            with patch('octodns_scaleway.sqlite3.connect') as connect:
+                for _ in range(3):
+                    a.reserve()
+                connect.assert_not_called()
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    conn = executor.submit(a._connection).result()
+                connect.assert_called_once_with(path, timeout=30,
+                                                isolation_level=None)
+                self.assertIsNot(a._connection(), conn)
+
+            # left usable after a failed reservation
+            with patch('octodns_scaleway.time', side_effect=OSError()):
+                with self.assertRaises(OSError):
+                    a.reserve()
+            a.reserve()
+
+            # processes drawing from the same bucket stay under its rate
+            start = perf_counter()
+            with ProcessPoolExecutor(max_workers=3) as executor:
+                list(executor.map(_drain_bucket, [path] * 3, [20] * 3))
+            # 60 tokens at 100/s, 5 of them available at once
+            self.assertGreaterEqual(perf_counter() - start, 0.5)
+
+    def test_rate_limit(self):
+        with TemporaryDirectory() as tmpdir:
+            path = join(tmpdir, 'bucket.db')
+            client = ScalewayClient('token', 'test', False, rate_limit=10,
+                                    rate_limit_path=path)
+            self.assertEqual(10, client._bucket.burst)
+            self.assertEqual(path, client._bucket.path)
+
+            with requests_mock() as mock, \
+                    patch('octodns_scaleway.time', return_value=1000), \
+                    patch('octodns_scaleway.sleep') as sleep_mock:
+                mock.get(ANY, text='{"records": []}')
+                for _ in range(12):
+                    client.get_records('unit.tests')
+
+            self.assertEqual(2, sleep_mock.call_count)
+            self.assertAlmostEqual(0.1, sleep_mock.call_args_list[0][0][0])
+            self.assertAlmostEqual(0.2, sleep_mock.call_args_list[1][0][0])
+            self.assertAlmostEqual(0.3, client.metrics['rate_limited_seconds'])
+
+        # a bucket per account in the temporary directory by default
+        with TemporaryDirectory() as tmpdir, \
+                patch('octodns_scaleway.gettempdir', return_value=tmpdir):
+            client = ScalewayClient('token', 'test', False, rate_limit=10,
+                                    rate_limit_burst=20)
+            self.assertEqual(20, client._bucket.burst)
+            self.assertEqual(join(tmpdir, 'octodns-scaleway-rate-limit.db'),
+                             client._bucket.path)
+            self.assertNotIn('token', client._bucket.name)
+
+    def test_circuit_breaker(self):
+        client = ScalewayClient('token', 'test', False)
+        url = '/domain/v2beta1/dns-zones/unit.tests/records'
+
+        with requests_mock() as mock, \
+                patch('octodns_scaleway.monotonic', return_value=1000) as now:
+            # healthy requests and client errors keep it closed
+            mock.get(url, status_code=404)
+            for _ in range(20):
+                with self.assertRaises(ScalewayClientNotFound):
+                    client.get_records('unit.tests')
+            self.assertEqual('closed', client._breaker.state)
+
+            # opened once half of the recent requests failed
+            mock.get(url, [{'status_code': 503}] * 9 +
+                     [{'exc': ConnectionError}])
+            for _ in range(9):
+                with self.assertRaises(HTTPError):
+                    client.get_records('unit.tests')
+            self.assertEqual('closed', client._breaker.state)
+            with self.assertRaises(ConnectionError):
+                client.get_records('unit.tests')
+            self.assertEqual('open', client._breaker.state)
+
+            # failing fast without any request while open
+            mock.reset_mock()
+            now.return_value = 1010
+            with self.assertRaises(ScalewayClientCircuitOpen) as ctx:
+                client.get_records('unit.tests')
+            self.assertEqual(20, ctx.exception.retry_in)
+            self.assertEqual('Circuit open, the API is failing, next probe '
+                             'in 20s', str(ctx.exception))
+            self.assertFalse(mock.called)
+            self.assertEqual(1, client.metrics['circuit_rejected'])
+            # requests sent before it opened don't push the probe back
+            client._breaker.record(False)
+            with self.assertRaises(ScalewayClientCircuitOpen) as ctx:
+                client.get_records('unit.tests')
+            self.assertEqual(20, ctx.exception.retry_in)
+
+            # a failed probe opens it again
+            now.return_value = 1030
+            mock.get(url, status_code=500)
+            with self.assertRaises(HTTPError):
+                client.get_records('unit.tests')
+            self.assertEqual('open', client._breaker.state)
+            self.assertEqual(1, mock.call_count)
+
+            # a single probe while half-open, closed when it succeeds
+            now.return_value = 1060
+            probing = []
+
+            def probe(request, context):
+                with self.assertRaises(ScalewayClientCircuitOpen) as ctx:
+                    client._breaker.check()
+                probing.append(ctx.exception.retry_in)
+                return '{"records": []}'
+
+            mock.get(url, text=probe)
+            self.assertEqual([], client.get_records('unit.tests'))
+            self.assertEqual([0], probing)
+            self.assertEqual('closed', client._breaker.state)
+            mock.get(url, text='{"records": []}')
+            self.assertEqual([], client.get_records('unit.tests'))
+
+            # running out of time tells nothing about the API
+            with patch.object(client, '_transmit',
+                              side_effect=ScalewayClientDeadlineExceeded):
+                for _ in range(20):
+                    with self.assertRaises(ScalewayClientDeadlineExceeded):
+                        client.get_records('unit.tests')
+                self.assertEqual('closed', client._breaker.state)
+
+                # nor does a probe, the next request probing again
+                for _ in range(20):
+                    client._breaker.record(False)
+                now.return_value = 1100
+                with self.assertRaises(ScalewayClientDeadlineExceeded):
+                    client.get_records('unit.tests')
+                self.assertEqual('open', client._breaker.state)
+            self.assertEqual([], client.get_records('unit.tests'))
+            self.assertEqual('closed', client._breaker.state)
+
+    def test_hedger(self):
+        hedger = _Hedger(90, 0.05, 4)
+
+        def fast():
+            return Mock()
+
+        # no hedging until enough latencies have been seen
+        for _ in range(_Hedger.MIN_SAMPLES):
+            r, hedges, won = hedger.send(fast)
+            self.assertEqual((0, False), (hedges, won))
+        self.assertIsNotNone(hedger._threshold(None))
+        # of the same kind
+        self.assertIsNone(hedger._threshold('other'))
+
+        # a slow request is duplicated and the duplicate answers first
+        first = Mock()
+        calls = []
+
+        def slow_first():
+            calls.append(None)
+            if len(calls) == 1:
+                sleep(0.5)
+                return first
+            return Mock()
+
+        start = perf_counter()
+        r, hedges, won = hedger.send(slow_first)
+        self.assertLess(perf_counter() - start, 0.4)
+        self.assertEqual((1, True), (hedges, won))
+        self.assertIsNot(first, r)
+        # the slow response is closed once it arrives
+        sleep(0.6)
+        first.close.assert_called_once()
+
+        # the budget caps the duplicates, 1 for 22 requests at 5%
+        calls.clear()
+        r, hedges, won = hedger.send(slow_first)
+        self.assertEqual((0, False), (hedges, won))
+        self.assertIs(first, r)
+
+        # a failed request is duplicated too
+        calls.clear()
+        for _ in range(20):
+            hedger.send(fast)
+
+        def fail_first():
+            calls.append(None)
+            if len(calls) == 1:
+                sleep(0.2)
+                raise ConnectionError()
+            sleep(0.3)
+            return first
+
+        r, hedges, won = hedger.send(fail_first)
+        self.assertEqual((1, True), (hedges, won))
+        self.assertIs(first, r)
+
+        # failing when every call failed
+        calls.clear()
+        hedger._hedges = 0
+
+        def fail():
+            calls.append(None)
+            sleep(0.2 if len(calls) == 1 else 0.3)
+            raise ConnectionError()
+
+        with self.assertRaises(ConnectionError):
+            hedger.send(fail)
+        self.assertEqual(2, len(calls))
+
+    def test_hedged_requests(self):
+        with TemporaryDirectory() as tmpdir:
+            client = ScalewayClient('token', 'test', False,
+                                    hedge_percentile=90, hedge_budget=1,
+                                    adaptive_concurrency=True,
+                                    rate_limit=1000,
+                                    rate_limit_path=join(tmpdir, 'db'))
+            calls = []
+
+            # stand-in for the server, slow on the first GET and every PATCH
+            def request(method, url, **kwargs):
+                calls.append(method)
+                if method == 'PATCH' or \
+                   len(calls) == _Hedger.MIN_SAMPLES + 1:
+                    sleep(0.3)
+                r = Response()
+                r.raw = BytesIO()
+                r.status_code = 200
+                r._content = b'{"records": []}'
+                return r
+
+            client._transport.request = request
+            limiter = client._limiter
+            with patch.object(client._bucket, 'reserve',
+                              wraps=client._bucket.reserve) as reserve, \
+                    patch.object(limiter, 'acquire',
+                                 wraps=limiter.acquire) as acquire:
+                for _ in range(_Hedger.MIN_SAMPLES + 1):
+                    client.get_records('unit.tests')
+            self.assertEqual(['GET'] * (_Hedger.MIN_SAMPLES + 2), calls)
+            self.assertEqual(1, client.metrics['hedges'])
+            self.assertEqual(1, client.metrics['hedge_wins'])
+            # the hedge took a token and a slot of its own, given back once the
+            # slow request answered
+            self.assertEqual(_Hedger.MIN_SAMPLES + 2, reserve.call_count)
+            self.assertEqual(_Hedger.MIN_SAMPLES + 2, acquire.call_count)
+            sleep(0.4)
+            self.assertEqual(0, limiter._in_flight)
+
+            # the latencies are kept per kind of request
+            self.assertEqual([('GET', '/dns-zones/{}/records', 1000)],
+                             list(client._hedger._latencies))
+
+            # writes are never hedged
+            calls.clear()
+            client.record_updates('unit.tests', {'changes': []})
+            self.assertEqual(['PATCH'], calls)
+            self.assertEqual(1, client.metrics['hedges'])
+
+    def test_deadline(self):
+        client = ScalewayClient('token', 'test', False,
+                                adaptive_concurrency=True)
+        with requests_mock() as mock:
+            mock.get(ANY, text='{"records": []}')
+
+            # no timeout without a deadline
+            client.get_records('unit.tests')
+            self.assertIsNone(mock.last_request.timeout)
+
+            # the time left is the timeout of the requests
+            client.deadline = monotonic() + 60
+            client.get_records('unit.tests')
+            self.assertAlmostEqual(60, mock.last_request.timeout, delta=5)
+
+            # nothing is sent once it passed
+            client.deadline = monotonic() - 1
+            with self.assertRaises(ScalewayClientDeadlineExceeded) as ctx:
+                client.get_records('unit.tests')
+            self.assertEqual('Deadline exceeded', str(ctx.exception))
+            self.assertEqual(2, mock.call_count)
+
+            # but by the threads let through
+            with client.without_deadline():
+                client.get_records('unit.tests')
+            self.assertIsNone(mock.last_request.timeout)
+            with self.assertRaises(ScalewayClientDeadlineExceeded):
+                client.get_records('unit.tests')
+            self.assertEqual(3, mock.call_count)
+
+        # timing out on the deadline
+        def request(method, url, **kwargs):
+            sleep(0.1)
+            raise Timeout()
+
+        client.deadline = monotonic() + 0.05
+        client._transport.request = request
+        with self.assertRaises(ScalewayClientDeadlineExceeded):
+            client.get_records('unit.tests')
+        # or before it
+        client._transport.request = Mock(side_effect=Timeout())
+        client.deadline = monotonic() + 60
+        with self.assertRaises(Timeout):
+            client.get_records('unit.tests')
+        client.deadline = None
+        with self.assertRaises(Timeout):
+            client.get_records('unit.tests')
+
+        # no waiting for a slot past the deadline
+        client.deadline = monotonic() + 60
+        client._limiter.limit = 1
+        generation = client._limiter.acquire()
+        client.deadline = monotonic() + 0.05
+        with self.assertRaises(ScalewayClientDeadlineExceeded):
+            client.get_records('unit.tests')
+        client._limiter.release(generation, 0.1, True)
+
+        # nor for rate limit tokens
+        with TemporaryDirectory() as tmpdir:
+            client = ScalewayClient('token', 'test', False, rate_limit=1,
+                                    rate_limit_path=join(tmpdir, 'bucket.db'),
+                                    deadline=monotonic() + 0.5)
+            with requests_mock() as mock, \
+                    patch('octodns_scaleway.time', return_value=1000), \
+                    patch('octodns_scaleway.sleep') as sleep_mock:
+                mock.get(ANY, text='{"records": []}')
+                client.get_records('unit.tests')
+                with self.assertRaises(ScalewayClientDeadlineExceeded):
+                    client.get_records('unit.tests')
+                sleep_mock.assert_not_called()
+                self.assertEqual(1, mock.call_count)
+
+    def test_http2_transport(self):
+        with self.assertRaises(ScalewayClientException) as ctx:
+            ScalewayClient('token', 'test', False, transport='carrier-pigeon')
+        self.assertEqual('Unknown transport carrier-pigeon, expected one of '
+                         'requests, http2', str(ctx.exception))
+        with patch.dict('sys.modules', {'httpx': None}), \
+                self.assertRaises(ScalewayClientException) as ctx:
+            ScalewayClient('token', 'test', False, transport='http2')
+        self.assertEqual('The http2 transport requires httpx[http2]',
+                         str(ctx.exception))
+
+        client = ScalewayClient('token', 'test', False, transport='http2')
+        self.assertIsInstance(client._transport, _Http2Transport)
+        client.close()
+        self.assertFalse(client._transport._thread.is_alive())
+        # closed along the provider
+        provider = ScalewayProvider('test', 'token', transport='http2')
+        thread = provider._client._transport._thread
+        provider.close()
+        self.assertFalse(thread.is_alive())
+        provider.close()
+
+        records = [{'name': f'www{n}', 'type': 'A', 'data': '1.2.3.4',
+                    'ttl': 300} for n in range(5)]
+        content = compress(json.dumps({'records': records}).encode())
+        requests = []
+
+        # streamed as over the network, the connection reset after the
+        # chunks when failing
+        class Stream(httpx.AsyncByteStream):
+
+            def __init__(self, chunks, failing=False):
+                self.chunks = chunks
+                self.failing = failing
+
+            async def __aiter__(self):
+                for chunk in self.chunks:
+                    yield chunk
+                if self.failing:
+                    raise httpx.ReadError('reset')
+
+        def handler(request):
+            requests.append(request)
+            if request.url.path.endswith('/missing/records'):
+                return httpx.Response(404)
+            elif request.url.path.endswith('/broken/records'):
+                return httpx.Response(500)
+            elif request.url.path.endswith('/slow/records'):
+                raise httpx.ReadTimeout('slow')
+            elif request.url.path.endswith('/down/records'):
+                raise httpx.ConnectError('down')
+            elif request.url.path.endswith('/reset/records'):
+                return httpx.Response(200, stream=Stream([b'{"records": ['],
+                                                         failing=True))
+            headers = {
+                'content-encoding': 'gzip',
+                'content-type': 'application/json; charset=utf-8',
+            }
+            return httpx.Response(200, headers=headers,
+                                  stream=Stream([content[:10],
+                                                 content[10:]]))
+
+        client._transport = _Http2Transport(
+            {'x-auth-token': 'token'}, transport=httpx.MockTransport(handler))
+
+        self.assertEqual(records, client.get_records('unit.tests'))
+        request = requests[-1]
+        self.assertEqual('token', request.headers['x-auth-token'])
+        self.assertEqual('/domain/v2beta1/dns-zones/unit.tests/records',
+                         request.url.path)
+        self.assertEqual({'page': '1', 'page_size': '1000'},
+                         dict(request.url.params))
+        # the bytes received are the compressed ones
+        self.assertEqual(len(content), client.metrics['bytes_received'])
+
+        # streamed
+        self.assertEqual(records, list(client.iter_zone_records(
+            'unit.tests')))
+        r = client._transport.request('GET', 'https://api.scaleway.com/',
+                                      stream=True)
+        decoded = json.dumps({'records': records}).encode()
+        self.assertEqual(decoded[:3], r.raw.read(3))
+        self.assertEqual(decoded[3:6], r.raw.read(3))
+        self.assertEqual(decoded[6:], r.raw.read(len(decoded)))
+        r.close()
+
+        # written
+        client.deadline = monotonic() + 60
+        client.record_updates('unit.tests', {'changes': []})
+        request = requests[-1]
+        self.assertEqual('PATCH', request.method)
+        self.assertEqual(b'{"changes":[]}', request.content)
+        self.assertAlmostEqual(60, request.extensions['timeout']['read'],
+                               delta=5)
+        client.deadline = None
+
+        # errors are the ones of requests
+        with self.assertRaises(ScalewayClientNotFound):
+            client.get_records('missing')
+        with self.assertRaises(HTTPError) as ctx:
+            client.get_records('broken')
+        self.assertIn('500 Server Error', str(ctx.exception))
+        with self.assertRaises(Timeout):
+            client.get_records('slow')
+        with self.assertRaises(ConnectionError):
+            client.get_records('down')
+        with self.assertRaises(ConnectionError):
+            client.get_records('reset')
+
+        # its loop stops with it
+        client.close()
+        self.assertFalse(client._transport._thread.is_alive())